@@ -0,0 +1,313 @@
+"""
+Command-line entry points for offline work that does not need the HTTP API.
+
+Usage:
+    python -m app.cli analyze corpus.jsonl -o results.jsonl --config '{"sentiment": true}' --workers 4
+    python -m app.cli train-cascade corpus.jsonl --task hate_speech --lang es
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Iterator
+
+from pydantic import ValidationError
+
+from app.core.config import settings
+from app.helpers.corpus import iter_records, read_texts, record_text
+from app.helpers.serialization import dumps, response_dict
+from app.models.schemas import SUPPORTED_LANGS, ConfigInput
+
+logger = logging.getLogger(__name__)
+
+Item = tuple[int, dict]
+
+def _init_worker(torch_threads: int | None, log_level: str):
+    """Worker process initializer: cap torch threads and load the default models once."""
+    logging.basicConfig(level=log_level, format=settings.LOG_FORMAT)
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+    from app.services.analyzer import analyzer_service
+    analyzer_service.load_models()
+
+def _analyze_chunk(items: list[tuple[str, dict]]) -> list[dict]:
+    """Analyze (text, config) pairs in a worker, returning JSON-ready responses in order."""
+    from app.helpers.analysis import _run_batch_analysis
+
+    results = _run_batch_analysis([(text, ConfigInput.model_validate(config)) for text, config in items])
+    return [response_dict(result) for result in results]
+
+def _prepare(records: Iterator[tuple[int, dict]], args: argparse.Namespace) -> Iterator[Item]:
+    """Turn input records into (index, output stub) pairs, validating text and config up front."""
+    default_config = json.loads(args.config)
+    for index, record in records:
+        stub: dict = {"index": index}
+        if args.id_field:
+            stub["id"] = record.get(args.id_field)
+        try:
+            text = record_text(record, args.text_field)
+            config = record.get("config")
+            if not isinstance(config, dict):
+                config = default_config
+            ConfigInput.model_validate(config)
+            if not text:
+                raise ValueError("text is empty")
+        except KeyError as e:
+            stub["error"] = e.args[0]
+        except (ValueError, ValidationError) as e:
+            stub["error"] = str(e)
+        else:
+            stub["_input"] = (text, config)
+        yield index, stub
+
+class Checkpoint:
+    """Progress marker next to the output file, written atomically after every chunk."""
+
+    def __init__(self, output: str):
+        self.path = output + ".checkpoint"
+
+    def load(self) -> dict | None:
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, input_path: str, records: int, output_bytes: int):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"input": input_path, "records": records, "output_bytes": output_bytes}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def analyze(args: argparse.Namespace) -> int:
+    checkpoint = Checkpoint(args.output)
+    state = checkpoint.load() if args.resume else None
+    if state is not None and state["input"] != os.path.abspath(args.input):
+        print(f"Checkpoint {checkpoint.path} belongs to {state['input']}. Use --no-resume to start over.", file=sys.stderr)
+        return 2
+
+    if state is not None and not os.path.exists(args.output):
+        state = None
+    skip = state["records"] if state else 0
+    mode = "r+b" if state else "wb"
+    out = open(args.output, mode)
+    if state:
+        # Drop anything written after the last checkpoint
+        out.truncate(state["output_bytes"])
+        out.seek(state["output_bytes"])
+        print(f"Resuming after {skip} records", file=sys.stderr)
+
+    records = islice(enumerate(iter_records(args.input)), skip, None)
+    prepared = _prepare(records, args)
+    chunks = iter(lambda: list(islice(prepared, args.chunk_size)), [])
+
+    if args.workers > 0:
+        pool = ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=_init_worker,
+            initargs=(args.threads_per_worker, args.log_level),
+        )
+        submit = pool.submit
+    else:
+        pool = None
+        _init_worker(args.threads_per_worker, args.log_level)
+
+        def submit(fn, *fn_args) -> Future:
+            future: Future = Future()
+            future.set_result(fn(*fn_args))
+            return future
+
+    processed = errors = 0
+    start = time.perf_counter()
+    # Keep a bounded window of chunks in flight and write them back in input order
+    in_flight: deque[tuple[list[Item], Future | None]] = deque()
+    max_in_flight = max(1, args.workers) * 2
+
+    def submit_chunk(chunk: list[Item]):
+        inputs = [stub["_input"] for _, stub in chunk if "_input" in stub]
+        in_flight.append((chunk, submit(_analyze_chunk, inputs) if inputs else None))
+
+    def write_chunk(chunk: list[Item], future: Future | None):
+        nonlocal processed, errors
+        results = iter(future.result() if future is not None else [])
+        for _, stub in chunk:
+            if "_input" in stub:
+                del stub["_input"]
+                stub.update(next(results))
+            else:
+                errors += 1
+            out.write(dumps(stub) + b"\n")
+        out.flush()
+        processed += len(chunk)
+        checkpoint.save(os.path.abspath(args.input), skip + processed, out.tell())
+
+    try:
+        for chunk in chunks:
+            submit_chunk(chunk)
+            while len(in_flight) >= max_in_flight:
+                write_chunk(*in_flight.popleft())
+        while in_flight:
+            write_chunk(*in_flight.popleft())
+    except KeyboardInterrupt:
+        print(f"\nInterrupted. Re-run the same command to resume after {skip + processed} records.", file=sys.stderr)
+        return 130
+    finally:
+        out.close()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    checkpoint.clear()
+    elapsed = time.perf_counter() - start
+    print(
+        f"Processed {processed} records ({errors} errors, {skip} skipped from checkpoint) "
+        f"in {elapsed:.1f}s: {processed / elapsed if elapsed else 0:.1f} records/s "
+        f"with {args.workers or 1} worker(s)",
+        file=sys.stderr,
+    )
+    return 0
+
+def train_cascade(args: argparse.Namespace) -> int:
+    """Label a corpus with the full model and fit the cascade scorer of a task to its decisions."""
+    import random
+    from collections import Counter
+
+    from app.helpers.analysis import _format_prediction
+    from app.services.analyzer import analyzer_service
+    from app.services.cascade import LinearScorer, decision, is_positive, negative_label, scorer_path
+
+    texts = list(dict.fromkeys(text for text in read_texts(args.input, args.limit, args.text_field) if text))
+    if len(texts) < 20:
+        print(f"Need at least 20 distinct texts to train a scorer, got {len(texts)}", file=sys.stderr)
+        return 2
+
+    start = time.perf_counter()
+    results: list[dict] = []
+    for offset in range(0, len(texts), args.chunk_size):
+        chunk = texts[offset:offset + args.chunk_size]
+        results.extend(_format_prediction(args.task, pred) for pred in analyzer_service.predict(args.task, chunk, args.lang))
+        print(f"Labeled {len(results)}/{len(texts)} texts with the full model", file=sys.stderr)
+    labeling_seconds = time.perf_counter() - start
+
+    # From the model, never from the corpus: a corpus that is mostly ironic must not flip the cascade
+    try:
+        negative = negative_label(args.task, analyzer_service.get_model(args.task, args.lang))
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    positives = [is_positive(result, negative) for result in results]
+    positive_counts = Counter(json.dumps(result["label"]) for result, positive in zip(results, positives) if positive)
+    if all(positives):
+        print(f"No text got the negative {args.task} label {negative!r}, so the model's labels do not match it", file=sys.stderr)
+        return 2
+    if not positive_counts:
+        print(f"The full model found no positive {args.task} texts in the corpus, nothing to learn from", file=sys.stderr)
+        return 2
+
+    order = list(range(len(texts)))
+    random.Random(args.seed).shuffle(order)
+    cut = int(len(order) * (1 - args.holdout))
+    train, holdout = order[:cut], order[cut:]
+    meta = {
+        "task": args.task,
+        "lang": args.lang,
+        "source_model": analyzer_service.model_id(args.task, args.lang),
+        "negative_label": negative,
+        "positive_label": json.loads(positive_counts.most_common(1)[0][0]),
+        "train_texts": len(train),
+        "positive_rate": round(sum(positives) / len(positives), 4),
+    }
+    start = time.perf_counter()
+    scorer = LinearScorer.train([texts[i] for i in train], [positives[i] for i in train], meta, epochs=args.epochs)
+    training_seconds = time.perf_counter() - start
+
+    report: dict = {**meta, "labeling_seconds": round(labeling_seconds, 1), "training_seconds": round(training_seconds, 1)}
+    if holdout:
+        low, high = settings.cascade.low(args.task), settings.cascade.high(args.task)
+        start = time.perf_counter()
+        scores = scorer.score([texts[i] for i in holdout])
+        scoring_ms = (time.perf_counter() - start) * 1000 / len(holdout)
+        decisions = [(decision(args.task, float(score)), positives[i]) for score, i in zip(scores, holdout)]
+        screened = [(screened_positive, positive) for screened_positive, positive in decisions if screened_positive is not None]
+        report["holdout"] = {
+            "texts": len(holdout),
+            "low": low,
+            "high": high,
+            "accuracy_at_0.5": round(sum((score >= 0.5) == positives[i] for score, i in zip(scores, holdout)) / len(holdout), 4),
+            "screened_fraction": round(len(screened) / len(holdout), 4),
+            "escalated_fraction": round(1 - len(screened) / len(holdout), 4),
+            "screened_agreement": round(sum(a == b for a, b in screened) / len(screened), 4) if screened else None,
+            "scorer_ms_per_text": round(scoring_ms, 4),
+            "full_model_ms_per_text": round(labeling_seconds * 1000 / len(texts), 2),
+        }
+    meta["holdout"] = report.get("holdout")
+
+    path = scorer_path(args.task, args.lang) if args.output is None else Path(args.output)
+    scorer.save(path)
+    print(json.dumps(report, indent=2))
+    print(f"Saved the {args.task} ({args.lang}) scorer to {path}", file=sys.stderr)
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--log-level", default="WARNING", help="Logging level for the CLI and its workers")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    analyze_parser = commands.add_parser(
+        "analyze",
+        help="Analyze a JSONL or CSV corpus into a JSONL results file",
+        description="Analyze every record of a JSONL or CSV file with a pool of worker processes. "
+        "Results are written in input order, one JSON line per record. Progress is checkpointed "
+        "next to the output so an interrupted run resumes where it stopped.",
+    )
+    analyze_parser.add_argument("input", help="Input .jsonl or .csv file")
+    analyze_parser.add_argument("-o", "--output", required=True, help="Output .jsonl file")
+    analyze_parser.add_argument(
+        "--config",
+        default='{"sentiment": true}',
+        help="ConfigInput as JSON, used for records without their own \"config\" object",
+    )
+    analyze_parser.add_argument("--text-field", help="Field holding the text (default: text, then body)")
+    analyze_parser.add_argument("--id-field", help="Field copied to the output as \"id\"")
+    analyze_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes, 0 to run in-process")
+    analyze_parser.add_argument("--threads-per-worker", type=int, help="torch threads per worker, to avoid oversubscribing the CPU")
+    analyze_parser.add_argument("--chunk-size", type=int, default=settings.pysentimiento.BATCH_SIZE, help="Records per batch sent to a worker")
+    analyze_parser.add_argument("--no-resume", dest="resume", action="store_false", help="Ignore any checkpoint and start over")
+    analyze_parser.set_defaults(func=analyze)
+
+    cascade_parser = commands.add_parser(
+        "train-cascade",
+        help="Train the cheap first-stage scorer of the hate_speech/irony cascade",
+        description="Run the full model of a task over a corpus and fit a hashed linear scorer to its "
+        "decisions. A held-out part of the corpus is used to report how many texts the configured "
+        "CASCADE__LOW/HIGH thresholds would screen and how often the screening agrees with the full model.",
+    )
+    cascade_parser.add_argument("input", help="Input .jsonl or .csv file")
+    cascade_parser.add_argument("--task", choices=["hate_speech", "irony"], default="hate_speech", help="Task to screen")
+    cascade_parser.add_argument("--lang", choices=SUPPORTED_LANGS, default=settings.pysentimiento.LANG, help="Language of the corpus")
+    cascade_parser.add_argument("--text-field", help="Field holding the text (default: text, then body)")
+    cascade_parser.add_argument("--limit", type=int, help="Read at most this many records")
+    cascade_parser.add_argument("--holdout", type=float, default=0.2, help="Fraction of texts kept out of training for the report")
+    cascade_parser.add_argument("--epochs", type=int, default=300, help="Training passes over the corpus")
+    cascade_parser.add_argument("--seed", type=int, default=0, help="Seed of the train/holdout split")
+    cascade_parser.add_argument("--chunk-size", type=int, default=settings.pysentimiento.BATCH_SIZE, help="Texts per full-model batch")
+    cascade_parser.add_argument("-o", "--output", help="Scorer file (default: CASCADE__DIR/<task>-<lang>.npz)")
+    cascade_parser.set_defaults(func=train_cascade)
+    return parser
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level, format=settings.LOG_FORMAT)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
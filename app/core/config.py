@@ -1,20 +1,32 @@
 import sys
 from functools import lru_cache
+from typing import Literal
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, field_validator
-import torch
-
-from app.models.schemas import Device
+from app.core.timing import startup_timer
+from app.models.schemas import Device, match_lang
 
 load_dotenv()
 
 class PysentimientoSettings(BaseSettings): 
     LANG: str = "es"
     DEFAULT_MODELS: list[str] = ["sentiment", "emotion", "hate_speech"]
-    PREPROCESS_TWEETS: bool = False
+    # Normalize user handles, URLs, hashtags, emojis and laughs with pysentimiento's
+    # preprocess_tweet before sentiment, emotion, hate_speech and irony, as their
+    # models were trained on. Disable only for inputs that are already preprocessed
+    PREPROCESS_TWEETS: bool = True
+    # Texts per padded forward pass when a model receives a list of texts
+    BATCH_SIZE: int = 32
+    # Limits for the (task, lang) model registry. When exceeded, the least
+    # recently used models are unloaded. None disables the limit
+    MAX_MODELS: int | None = None
+    MEMORY_BUDGET_MB: float | None = None
+    # Default models are loaded in parallel by this many threads at startup
+    LOAD_WORKERS: int = 4
+    # Run a few predictions through each default model before reporting ready
+    WARMUP: bool = False
     
     model_config = SettingsConfigDict(
         env_prefix="PYSENTIMIENTO__",
@@ -25,23 +37,181 @@ class PysentimientoSettings(BaseSettings):
     def normalize_lang(cls, v: str) -> str:
         if not v:
             return "es"
-        v_lower = v.lower()
-        supported = ['es', 'en', 'it', 'pt']
-        for lang in supported:
-            if v_lower == lang or v_lower.startswith(f"{lang}_") or v_lower.startswith(f"{lang}."):
-                return lang
-        return "es"
+        return match_lang(v) or "es"
+
+class BatchingSettings(BaseSettings):
+    """Micro-batching of concurrent single-text predictions."""
+
+    ENABLED: bool = False
+    # Tasks whose single-text predictions are merged into batches
+    TASKS: list[str] = ["sentiment", "emotion", "hate_speech", "irony"]
+    MAX_BATCH_SIZE: int = 32
+    MAX_WAIT_MS: float = 5.0
+    # Per-task overrides, e.g. {"emotion": 64}
+    TASK_MAX_BATCH_SIZE: dict[str, int] = {}
+    TASK_MAX_WAIT_MS: dict[str, float] = {}
+
+    model_config = SettingsConfigDict(
+        env_prefix="BATCHING__",
+    )
+
+    def max_batch_size(self, task: str) -> int:
+        return self.TASK_MAX_BATCH_SIZE.get(task, self.MAX_BATCH_SIZE)
+
+    def max_wait_ms(self, task: str) -> float:
+        return self.TASK_MAX_WAIT_MS.get(task, self.MAX_WAIT_MS)
+
+class CacheSettings(BaseSettings):
+    """Caches of per-task prediction results, in memory and on disk."""
+
+    ENABLED: bool = False
+    MAX_SIZE: int = 10000
+    # Entries older than this are treated as misses. None keeps them until evicted
+    TTL_SECONDS: float | None = None
+    # SQLite file shared by every worker process and kept across restarts,
+    # consulted on in-memory misses
+    DISK_ENABLED: bool = False
+    DISK_PATH: str = "prediction_cache.db"
+    # The least recently used entries are deleted once the live data grows past this
+    DISK_MAX_MB: float = 1024
+
+    model_config = SettingsConfigDict(
+        env_prefix="CACHE__",
+    )
+
+class CascadeSettings(BaseSettings):
+    """Cheap first-stage screening in front of the hate_speech and irony models."""
+
+    ENABLED: bool = False
+    # Tasks screened when a scorer trained with `python -m app.cli train-cascade` exists for them
+    TASKS: list[str] = ["hate_speech", "irony"]
+    # Scorers are read from DIR/<task>-<lang>.npz
+    DIR: str = "cascade_models"
+    # Texts scored below LOW are answered as negative and above HIGH as positive
+    # without the full model. Everything in between is escalated. None disables a side
+    LOW: float | None = 0.05
+    HIGH: float | None = None
+    # Per-task overrides, e.g. {"irony": 0.1}
+    TASK_LOW: dict[str, float | None] = {}
+    TASK_HIGH: dict[str, float | None] = {}
+    # Fraction of screened texts also run through the full model, to keep
+    # measuring how often both stages agree
+    AUDIT_RATE: float = 0.01
+
+    model_config = SettingsConfigDict(
+        env_prefix="CASCADE__",
+    )
+
+    def low(self, task: str) -> float | None:
+        return self.TASK_LOW.get(task, self.LOW)
+
+    def high(self, task: str) -> float | None:
+        return self.TASK_HIGH.get(task, self.HIGH)
+
+class SchedulerSettings(BaseSettings):
+    """Admission control for analysis jobs, per priority lane."""
+
+    # Jobs allowed to wait per lane. Beyond that, requests get a 429
+    INTERACTIVE_MAX_QUEUE: int = 64
+    BULK_MAX_QUEUE: int = 16
+    # Jobs still queued after this many seconds are dropped with a 503. None waits forever
+    INTERACTIVE_DEADLINE_SECONDS: float | None = 10.0
+    BULK_DEADLINE_SECONDS: float | None = 120.0
+    # Workers that only ever run interactive jobs
+    RESERVED_INTERACTIVE_WORKERS: int = 1
+
+    model_config = SettingsConfigDict(
+        env_prefix="SCHEDULER__",
+    )
+
+    def max_queue(self, lane: str) -> int:
+        return self.BULK_MAX_QUEUE if lane == "bulk" else self.INTERACTIVE_MAX_QUEUE
+
+    def deadline(self, lane: str) -> float | None:
+        return self.BULK_DEADLINE_SECONDS if lane == "bulk" else self.INTERACTIVE_DEADLINE_SECONDS
+
+class LongTextSettings(BaseSettings):
+    """Sliding windows for texts analyzed with `long_text` enabled."""
+
+    # Tokens per window of sentiment, emotion, hate_speech and irony. None uses
+    # the model's maximum sequence length
+    WINDOW_TOKENS: int | None = None
+    # Tokens shared by consecutive windows
+    STRIDE_TOKENS: int = 32
+    # Words per window of the models fed raw text (ner, pos), and words shared
+    # by consecutive windows. Entities in the overlap are kept once
+    WINDOW_WORDS: int = 80
+    STRIDE_WORDS: int = 20
+
+    model_config = SettingsConfigDict(
+        env_prefix="LONG_TEXT__",
+    )
+
+class JobsSettings(BaseSettings):
+    """Asynchronous analysis jobs kept in a local SQLite database."""
+
+    ENABLED: bool = True
+    DB_PATH: str = "jobs.db"
+    # Texts per analysis batch. Each batch is one bulk-lane scheduler job
+    BATCH_SIZE: int = 256
+    # A job whose runner stops renewing its claim for this long is picked up
+    # by another worker, or after a restart
+    LEASE_SECONDS: float = 60.0
+    # Seconds between checks for new jobs while idle
+    POLL_SECONDS: float = 1.0
+    # Largest inline `texts` list accepted by POST /jobs. Upload bigger datasets
+    MAX_INLINE_TEXTS: int = 10000
+
+    model_config = SettingsConfigDict(
+        env_prefix="JOBS__",
+    )
+
+class InferenceSettings(BaseSettings):
+    """Inference backend selection and tuning."""
+
+    # "torch" runs pysentimiento's analyzers as-is. "onnx" serves ONNX_TASKS with
+    # ONNX Runtime, exporting each model to ONNX_DIR on first load
+    BACKEND: Literal["torch", "onnx"] = "torch"
+    ONNX_TASKS: list[str] = ["sentiment", "emotion", "hate_speech", "irony"]
+    ONNX_DIR: str = "onnx_models"
+    # Max probability difference allowed between a fresh export and torch
+    ONNX_PARITY_TOLERANCE: float = 1e-3
+    # ONNX Runtime intra-op threads. None lets it use every core
+    ONNX_THREADS: int | None = None
+    # Dynamic int8 quantization of the linear layers of torch-served models (CPU only)
+    QUANTIZE: bool = False
+    # torch intra-op threads per serving process. None keeps torch's default of
+    # one per core, which oversubscribes the CPU when several workers run
+    TORCH_THREADS: int | None = None
+    # Torch-served models are converted once to safetensors in SAFETENSORS_DIR/<task>-<lang>/
+    # and their weights memory-mapped from there, so every process serving the
+    # same model shares them through the OS page cache. None loads them as usual
+    SAFETENSORS_DIR: str | None = None
+    # Never contact the Hugging Face Hub: models come from SAFETENSORS_DIR or the local hub cache
+    OFFLINE: bool = False
+
+    model_config = SettingsConfigDict(
+        env_prefix="INFERENCE__",
+    )
 
 class Settings(BaseSettings):
     LOG_LEVEL: str = Field(default="INFO")
     LOG_FORMAT: str = Field(default="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    LOG_SAMPLE_RATE: float = Field(
+        default=0.01,
+        ge=0,
+        le=1,
+        description="Fraction of requests logged as a JSON line of metadata (never the texts). Errors are always logged",
+    )
+    LOG_SLOW_REQUEST_MS: float | None = Field(
+        default=1000,
+        description="Requests slower than this are always logged. None disables it",
+    )
     ENVIRONMENT: str = Field(default="production")
 
-    DEVICE: Device = Field(
-        default_factory=lambda: Device.cuda
-        if torch.cuda.is_available()
-        else Device.cpu,
-        description="Device to use for computation (cuda or cpu)",
+    DEVICE: Device | None = Field(
+        default=None,
+        description="Device to use for computation (cuda or cpu). Detected with torch on first use when unset",
     )
 
     model_config = SettingsConfigDict(
@@ -51,17 +221,66 @@ class Settings(BaseSettings):
         extra="ignore",
     )
 
+    WORKERS: int = Field(
+        default=1,
+        description="Serving processes. Above 1, models are loaded once and shared copy-on-write by forked workers. 0 uses one per CPU core",
+    )
+
+    EXECUTOR_MAX_WORKERS: int = Field(
+        default=4,
+        description="Scheduler threads running analysis jobs. Raise it with micro-batching so more requests can wait on a shared batch",
+    )
+
+    MAX_TASK_CONCURRENCY: int = Field(
+        default=4,
+        description="Tasks of one request run at the same time. 1 runs them one after another",
+    )
+
+    STREAM_CHUNK_SIZE: int = Field(
+        default=64,
+        description="Records analyzed per batch by the NDJSON streaming endpoint",
+    )
+    STREAM_MAX_LINE_BYTES: int = Field(
+        default=1024 * 1024,
+        description="Longest NDJSON record accepted by the streaming endpoint",
+    )
+    WS_WINDOW: int = Field(
+        default=256,
+        ge=1,
+        description="Messages a WebSocket client may have in flight before the server stops reading from it",
+    )
+    WS_MAX_BATCH_SIZE: int = Field(
+        default=64,
+        ge=1,
+        description="Messages of one WebSocket connection analyzed together in one batch",
+    )
+
     # Nested settings
     pysentimiento: PysentimientoSettings = Field(default_factory=PysentimientoSettings)
+    batching: BatchingSettings = Field(default_factory=BatchingSettings)
+    cache: CacheSettings = Field(default_factory=CacheSettings)
+    cascade: CascadeSettings = Field(default_factory=CascadeSettings)
+    scheduler: SchedulerSettings = Field(default_factory=SchedulerSettings)
+    inference: InferenceSettings = Field(default_factory=InferenceSettings)
+    long_text: LongTextSettings = Field(default_factory=LongTextSettings)
+    jobs: JobsSettings = Field(default_factory=JobsSettings)
+
+    @property
+    def device(self) -> Device:
+        """DEVICE, or cuda when torch can see a GPU and cpu otherwise.
+
+        Resolved on first use so that importing the settings never imports torch.
+        """
+        if self.DEVICE is None:
+            import torch
+            self.DEVICE = Device.cuda if torch.cuda.is_available() else Device.cpu
+        return self.DEVICE
 
     @field_validator("ENVIRONMENT", mode="before")
     @classmethod
     def normalize_environment(cls, v: str) -> str:
         return str(v).lower() if v else "production"
 
-# Global executor
-executor = ThreadPoolExecutor(max_workers=4)
-
 @lru_cache
 def get_settings() -> Settings:
     """
@@ -72,4 +291,5 @@ def get_settings() -> Settings:
     """
     return Settings()
 
-settings = get_settings()
+with startup_timer.phase("settings"):
+    settings = get_settings()
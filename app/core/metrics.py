@@ -0,0 +1,169 @@
+"""
+Minimal Prometheus metrics in the text exposition format.
+
+Counters, gauges and histograms with labels, cheap enough to update on every
+request: one lock and a dict lookup per update. Gauges and counters can also
+be computed at scrape time from a callback, for values that are already kept
+elsewhere (queue depths, cache statistics). Values are per process.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+LabelValues = tuple[str, ...]
+Collect = Callable[[], Iterable[tuple[LabelValues, float]]]
+
+# Seconds, from a cached lookup to a long document or a cold model load
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        return "".join(metric.render() for metric in metrics)
+
+REGISTRY = Registry()
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[LabelValues, float] = {}
+        self._collect: Collect | None = None
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: dict) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def set_function(self, collect: Collect):
+        """Compute the samples at scrape time as (label values, value) pairs."""
+        self._collect = collect
+
+    def samples(self) -> list[tuple[str, LabelValues, float]]:
+        if self._collect is not None:
+            return [("", tuple(str(v) for v in values), value) for values, value in self._collect()]
+        with self._lock:
+            return [("", values, value) for values, value in self._values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, values, value in self.samples():
+            names = self.labelnames + (("le",) if suffix == "_bucket" else ())
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS, registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: non-cumulative bucket counts (last one is +Inf), sum
+        self._series: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> list[tuple[str, LabelValues, float]]:
+        with self._lock:
+            series = {key: (list(counts), total[0]) for key, (counts, total) in self._series.items()}
+        samples = []
+        for values, (counts, total) in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", values + (_format_value(bound),), cumulative))
+            samples.append(("_sum", values, total))
+            samples.append(("_count", values, cumulative))
+        return samples
+
+# Application metrics
+
+REQUESTS = Counter("sentiment_api_requests_total", "HTTP requests by endpoint and status code", ["endpoint", "status"])
+REQUEST_SECONDS = Histogram("sentiment_api_request_duration_seconds", "Time to respond to a request, queueing included", ["endpoint"])
+ANALYSIS_SECONDS = Histogram("sentiment_api_analysis_duration_seconds", "Time to analyze one request's texts on a worker thread, all tasks included")
+INFERENCE_SECONDS = Histogram("sentiment_api_inference_duration_seconds", "Time of one model call", ["task", "lang"])
+INFERENCE_TEXTS = Counter("sentiment_api_inference_texts_total", "Texts run through a model", ["task", "lang"])
+BATCH_SIZE = Histogram("sentiment_api_inference_batch_size", "Texts per model call", ["task"], buckets=SIZE_BUCKETS)
+QUEUE_WAIT_SECONDS = Histogram("sentiment_api_scheduler_queue_wait_seconds", "Time jobs waited for a scheduler thread", ["lane"])
+QUEUE_DEPTH = Gauge("sentiment_api_scheduler_queue_depth", "Jobs waiting for a scheduler thread", ["lane"])
+ACTIVE_THREADS = Gauge("sentiment_api_scheduler_active_threads", "Scheduler threads running a job", ["lane"])
+SCHEDULER_THREADS = Gauge("sentiment_api_scheduler_threads", "Scheduler threads")
+REJECTED = Counter("sentiment_api_scheduler_rejected_total", "Jobs rejected because their lane was full", ["lane"])
+EXPIRED = Counter("sentiment_api_scheduler_expired_total", "Jobs dropped after waiting past their lane's deadline", ["lane"])
+MODEL_LOAD_SECONDS = Gauge("sentiment_api_model_load_duration_seconds", "Time the loaded model took to load", ["task", "lang"])
+MODEL_MEMORY_BYTES = Gauge("sentiment_api_model_memory_bytes", "Estimated memory of a loaded model", ["task", "lang"])
+CASCADE_TEXTS = Counter("sentiment_api_cascade_texts_total", "Texts handled by the cascade, by the stage that answered", ["task", "stage"])
+CASCADE_AGREEMENT = Counter("sentiment_api_cascade_agreement_total", "Texts run through both cascade stages, by whether their decisions agreed", ["task", "result"])
+WS_CONNECTIONS = Gauge("sentiment_api_websocket_connections", "Open /ws/analyze connections")
+JOBS = Gauge("sentiment_api_jobs", "Asynchronous jobs in the job store by status", ["status"])
+JOB_TEXTS = Counter("sentiment_api_job_texts_total", "Job texts processed by this process's runner, by outcome", ["outcome"])
+CACHE_REQUESTS = Counter("sentiment_api_cache_requests_total", "Prediction cache lookups by result", ["result"])
+CACHE_EVICTIONS = Counter("sentiment_api_cache_evictions_total", "Prediction cache entries evicted")
+CACHE_SIZE = Gauge("sentiment_api_cache_size", "Prediction cache entries")
+DISK_CACHE_REQUESTS = Counter("sentiment_api_disk_cache_requests_total", "On-disk prediction cache lookups by result", ["result"])
+DISK_CACHE_EVICTIONS = Counter("sentiment_api_disk_cache_evictions_total", "On-disk prediction cache entries deleted by compaction")
+DISK_CACHE_BYTES = Gauge("sentiment_api_disk_cache_bytes", "Live data in the on-disk prediction cache")
@@ -0,0 +1,49 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+class Profile:
+    """Per-stage wall-clock timings of one request, in milliseconds.
+
+    Stages recorded more than once (e.g. preprocessing for several tokenizers)
+    accumulate. Stages of concurrently running tasks overlap, so they do not
+    add up to the total.
+    """
+
+    def __init__(self):
+        self.timings: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds * 1000
+
+    def rounded(self) -> dict[str, float]:
+        with self._lock:
+            return {stage: round(ms, 3) for stage, ms in self.timings.items()}
+
+_current: ContextVar[Profile | None] = ContextVar("profile", default=None)
+
+@contextmanager
+def use_profile(profile: Profile | None) -> Iterator[None]:
+    """Make `profile` the one stages are recorded into, in this thread or task."""
+    token = _current.set(profile)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block into the active profile. Costs a single lookup when profiling is off."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
@@ -0,0 +1,113 @@
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+from app.core.config import settings
+from app.core.timing import startup_timer
+
+logger = logging.getLogger(__name__)
+
+# Set in forked workers to the PID of the parent holding the shared models
+parent_pid: int | None = None
+
+def configure_torch_threads():
+    """Apply INFERENCE__TORCH_THREADS to the current process."""
+    if settings.inference.TORCH_THREADS:
+        import torch
+        torch.set_num_threads(settings.inference.TORCH_THREADS)
+
+def _run_worker(app, sock: socket.socket, slot: int):
+    global parent_pid
+    parent_pid = os.getppid()
+    # Own process group, so a Ctrl-C in the terminal reaches the parent only
+    # and workers get a single SIGTERM for a graceful shutdown
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    logger.info("Worker %d started (pid %d)", slot, os.getpid())
+    config = uvicorn.Config(app, log_level=settings.LOG_LEVEL.lower(), lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+def serve_preforked(app, host: str, port: int, workers: int):
+    """
+    Load the default models once, then fork `workers` uvicorn processes sharing them.
+
+    Forked workers see the parent's model weights copy-on-write, so N workers cost
+    roughly one copy of the models plus their own working memory instead of N copies.
+    The parent only supervises: it restarts workers that die and forwards SIGINT/SIGTERM.
+    Nothing that starts threads (batchers, executors, warm-up inference) may run
+    before the fork, since threads do not survive it. ONNX-served models are
+    therefore only exported here, in a subprocess; ONNX Runtime reads a model
+    into each session's own memory, so every worker holds a private copy of them.
+    """
+    from app.services.analyzer import analyzer_service
+
+    logging.basicConfig(level=settings.LOG_LEVEL, format=settings.LOG_FORMAT)
+    logger.info("Loading models in the parent process before forking %d workers...", workers)
+    # Workers warm up and open their ONNX sessions on their own, after the fork
+    analyzer_service.load_models(warmup=False, fork_safe=True)
+    startup_timer.mark_ready()
+    # Move everything allocated so far out of the collector's reach. Otherwise
+    # each worker's first collections write to the GC headers of every shared
+    # object and copy the pages holding them
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children: dict[int, int] = {}
+    stopping = False
+
+    def spawn(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                _run_worker(app, sock, slot)
+                code = 0
+            finally:
+                os._exit(code)
+        children[pid] = slot
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    logger.info("Serving on http://%s:%d with %d workers sharing the models", host, port, workers)
+    for slot in range(workers):
+        spawn(slot)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        slot = children.pop(pid, None)
+        if slot is None or stopping:
+            continue
+        logger.warning(
+            "Worker %d (pid %d) exited with status %d. Restarting it...",
+            slot, pid, os.waitstatus_to_exitcode(status),
+        )
+        # Avoid a tight restart loop when workers crash on startup
+        time.sleep(1)
+        if not stopping:
+            spawn(slot)
+    sock.close()
+    logger.info("All workers stopped.")
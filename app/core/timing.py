@@ -0,0 +1,45 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+class StartupTimer:
+    """Wall-clock durations of the startup phases, measured from the first import of this module."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase: str, seconds: float):
+        """Record a phase once. Repeats, such as a forked worker re-running
+        load_models over the models it inherited, keep the first measurement."""
+        with self._lock:
+            self.phases.setdefault(phase, seconds)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def summary(self) -> dict[str, float]:
+        """Recorded phases in seconds, rounded to milliseconds."""
+        with self._lock:
+            return {name: round(seconds, 3) for name, seconds in self.phases.items()}
+
+    def mark_ready(self):
+        """Record the time from the origin until now as `ready` and log the breakdown."""
+        with self._lock:
+            self.phases["ready"] = time.perf_counter() - self.origin
+        logger.info(
+            "Startup timing: %s",
+            ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.summary().items()),
+        )
+
+startup_timer = StartupTimer()
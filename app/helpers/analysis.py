@@ -1,89 +1,292 @@
+import contextvars
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+from app.core import metrics, profiling
+from app.core.config import settings
 from app.services.analyzer import analyzer_service
+from app.services.cache import disk_cache, prediction_cache
+from app.services.cascade import cascade
+from app.services.encoding import SharedEncodings
 from app.models.schemas import ConfigInput, AnalysisResponse
 
 logger = logging.getLogger(__name__)
 
-def _run_analysis(text: str, config: ConfigInput) -> AnalysisResponse:
-    """CPU-bound inference in thread pool"""
+# Tasks in the order they are run and reported
+TASKS = ("sentiment", "emotion", "hate_speech", "irony", "ner", "pos", "targeted_sentiment")
 
-    response = {}
+# Tasks that consume the results of other tasks on the same texts. Upstream
+# tasks run first, once per request, whether or not the items asked for them
+DEPENDENCIES: dict[str, tuple[str, ...]] = {"targeted_sentiment": ("ner",)}
 
-    # Get predictions
-    if config.sentiment:
-        logger.info("Analyzing sentiment for text: %s", text)
-        sent_pred = analyzer_service.get_model("sentiment").predict(text)
-        logger.info("Sentiment result: %s", sent_pred)
-        response["sentiment"] = {
-            "label": sent_pred.output,
-            "probas": sent_pred.probas
-        }
+# Helpers running the extra tasks of requests that enable several. Sized so that
+# every scheduler thread can fan out to MAX_TASK_CONCURRENCY tasks at once
+task_executor = ThreadPoolExecutor(
+    max_workers=max(1, settings.EXECUTOR_MAX_WORKERS * (settings.MAX_TASK_CONCURRENCY - 1)),
+    thread_name_prefix="task",
+)
 
-    if config.emotion:
-        logger.info("Analyzing emotion for text: %s", text)
-        emot_pred = analyzer_service.get_model("emotion").predict(text)
-        logger.info("Emotion result: %s", emot_pred)
-        response["emotion"] = {
-            "label": emot_pred.output,
-            "probas": emot_pred.probas
+def _format_prediction(task: str, pred: Any) -> dict:
+    """Convert a pysentimiento prediction into the response shape for a task."""
+    if task == "ner":
+        return {
+            "entities": pred.entities,
+            "tokens": pred.tokens,
+            "labels": pred.labels
         }
-
-    if config.hate_speech:
-        logger.info("Analyzing hate speech for text: %s", text)
-        hate_pred = analyzer_service.get_model("hate_speech").predict(text)
-        logger.info("Hate speech result: %s", hate_pred)
-        response["hate_speech"] = {
-            "label": hate_pred.output,
-            "probas": hate_pred.probas
+    if task == "pos":
+        return {
+            "tokens": pred.tokens,
+            "labels": pred.labels
         }
-
-    if config.irony:
-        logger.info("Analyzing irony for text: %s", text)
-        irony_pred = analyzer_service.get_model("irony").predict(text)
-        logger.info("Irony result: %s", irony_pred)
-        response["irony"] = {
-            "label": irony_pred.output,
-            "probas": irony_pred.probas
+    if task == "targeted_sentiment":
+        return {
+            "label": pred.output,
+            "probas": getattr(pred, "probas", None)
         }
+    return {
+        "label": pred.output,
+        "probas": pred.probas
+    }
 
-    if config.ner:
-        logger.info("Analyzing Named Entity Recognition for text: %s", text)
-        ner_pred = analyzer_service.get_model("ner").predict(text)
-        logger.info("NER result: %s", ner_pred)
-        response["ner"] = {
-            "entities": ner_pred.entities,
-            "tokens": ner_pred.tokens,
-            "labels": ner_pred.labels
-        }
+def _shape_result(result: dict, config: ConfigInput) -> dict:
+    """Apply a config's output options to one task's result, leaving the (possibly cached) original untouched."""
+    if "targets" in result:
+        return {**result, "targets": [_shape_result(target, config) for target in result["targets"]]}
+    if config.labels_only:
+        return {key: value for key, value in result.items() if key not in ("probas", "score")}
+    probas = result.get("probas")
+    if not probas:
+        return result
+    if config.top_k is not None:
+        probas = dict(sorted(probas.items(), key=lambda item: item[1], reverse=True)[:config.top_k])
+    if config.round_probas is not None:
+        probas = {label: round(p, config.round_probas) for label, p in probas.items()}
+    return {**result, "probas": probas}
 
-    if config.pos:
-        logger.info("Analyzing Part-of-Speech Tagging for text: %s", text)
-        pos_pred = analyzer_service.get_model("pos").predict(text)
-        logger.info("POS result: %s", pos_pred)
-        response["pos"] = {
-            "tokens": pos_pred.tokens,
-            "labels": pos_pred.labels
-        }
+def _analyze_task(
+    task: str,
+    lang: str,
+    texts: list[str],
+    encodings: SharedEncodings | None = None,
+    long_text: bool = False,
+    targets: list[str] | None = None,
+) -> list[dict]:
+    """Run one task over unique texts of one language, consulting the prediction caches first.
+
+    With `targets`, each text is scored towards its target and the (text,
+    target) pairs must be unique instead.
+    """
+
+    results: list[dict | None] = [None] * len(texts)
+    keys: list[tuple] = []
+    screening = cascade.active(task, lang)
+    if prediction_cache.enabled or disk_cache.enabled:
+        model_id = analyzer_service.model_id(task, lang)
+        if long_text:
+            # Windowed results differ from truncated ones for the same model
+            model_id = f"{model_id}+long"
+        if screening:
+            model_id = f"{model_id}+cascade"
+        keys = [prediction_cache.make_key(text, task, lang, model_id) for text in texts]
+        if targets is not None:
+            keys = [key + (target,) for key, target in zip(keys, targets)]
+        results = [prediction_cache.get(key) for key in keys]
+    missing = [j for j, result in enumerate(results) if result is None]
+    if missing and disk_cache.enabled:
+        # One bulk lookup for everything the in-memory cache did not have
+        with profiling.stage(f"disk_cache:{task}"):
+            stored = disk_cache.get_many([keys[j] for j in missing])
+        for j, result in zip(missing, stored):
+            if result is not None:
+                results[j] = result
+                prediction_cache.put(keys[j], result)
+        missing = [j for j in missing if results[j] is None]
+    # Texts analyzed by this call, to be written to the caches
+    fresh = list(missing)
+
+    scores: dict[int, float] = {}
+    if missing and screening:
+        # Texts the cheap scorer is confident about never reach the full model
+        with profiling.stage(f"cascade:{task}"):
+            screened, screened_scores = cascade.screen(task, lang, [texts[j] for j in missing])
+        for j, result, score in zip(missing, screened, screened_scores):
+            results[j] = result
+            scores[j] = score
+        missing = [j for j in missing if results[j] is None]
+
+    if missing:
+        pending = [texts[j] for j in missing]
+        pending_targets = [targets[j] for j in missing] if targets is not None else None
+        logger.debug("Analyzing %s (%s) for %d text(s)", task, lang, len(pending))
+        preds = analyzer_service.predict(task, pending, lang, encodings, long_text, pending_targets)
+
+        for j, pred in zip(missing, preds):
+            results[j] = _format_prediction(task, pred)
+        if scores:
+            cascade.observe(task, lang, [scores[j] for j in missing], [results[j] for j in missing])
+
+    if keys and fresh:
+        for j in fresh:
+            prediction_cache.put(keys[j], results[j])
+        disk_cache.put_many([(keys[j], results[j]) for j in fresh])
+
+    return results
+
+def _analyze_targets(lang: str, texts: list[str], ner_results: list[dict]) -> list[dict]:
+    """Score the sentiment towards each entity NER found in each text.
+
+    Entities mentioned several times in a text are scored once, and every
+    (text, entity) pair of the request runs in one batch.
+    """
+    per_text: list[dict[str, str]] = []
+    for ner in ner_results:
+        targets: dict[str, str] = {}
+        for entity in ner["entities"]:
+            targets.setdefault(entity["text"], entity["type"])
+        per_text.append(targets)
+    pair_texts = [text for text, targets in zip(texts, per_text) for _ in targets]
+    pair_targets = [target for targets in per_text for target in targets]
+    scored = iter(_analyze_task("targeted_sentiment", lang, pair_texts, targets=pair_targets) if pair_texts else ())
+    return [
+        {"targets": [{"target": target, "type": entity_type, **next(scored)} for target, entity_type in targets.items()]}
+        for targets in per_text
+    ]
+
+def _run_limited(jobs: list[Callable[[], Any]], limit: int) -> list[tuple[Any, Exception | None]]:
+    """Run jobs with at most `limit` of them at once, returning (result, error) pairs in order.
+
+    The calling thread works through the jobs together with up to `limit - 1`
+    helpers from `task_executor`. Helpers that have not started by the time the
+    caller runs out of jobs are cancelled, so a saturated pool only makes the
+    request run more sequentially instead of blocking it.
+    """
+    outcomes: list[tuple[Any, Exception | None]] = [(None, None)] * len(jobs)
+    pending = iter(range(len(jobs)))
+    lock = threading.Lock()
 
-    if config.targeted_sentiment:
-        if config.lang != "es":
-            response.setdefault("warnings", []).append("Targeted sentiment analysis is only available in Spanish (es). Skipping.")
-        else:
+    def drain():
+        while True:
+            with lock:
+                j = next(pending, None)
+            if j is None:
+                return
             try:
-                # Check if model is available or loadable
-                # get_model will try to load it. 
-                # But we should probably check if we CAN load it? 
-                # The original code checked 'if "targeted_sentiment" not in settings.analyzer'
-                # But now get_model loads on demand.
-                # So we just call get_model.
-                logger.info("Analyzing Targeted Sentiment for text: %s", text)
-                targsent_pred = analyzer_service.get_model("targeted_sentiment").predict(text)
-                logger.info("Targeted Sentiment result: %s", targsent_pred)
-                response["targeted_sentiment"] = {
-                    "label": targsent_pred.output,
-                    "probas": getattr(targsent_pred, "probas", None)
-                }
+                outcomes[j] = (jobs[j](), None)
             except Exception as e:
-                 response.setdefault("warnings", []).append(f"Targeted sentiment model failed to load or run: {e}")
+                outcomes[j] = (None, e)
 
-    return response
+    # Each helper runs in a copy of the caller's context, so it profiles into the same request
+    helpers = [
+        task_executor.submit(contextvars.copy_context().run, drain)
+        for _ in range(min(limit, len(jobs)) - 1)
+    ]
+    drain()
+    for helper in helpers:
+        if not helper.cancel():
+            helper.result()
+    return outcomes
+
+def _depth(task: str) -> int:
+    """Stage of a task in the dependency graph: 0 for tasks without upstream tasks."""
+    return 1 + max((_depth(upstream) for upstream in DEPENDENCIES.get(task, ())), default=-1)
+
+@metrics.ANALYSIS_SECONDS.time()
+def _run_batch_analysis(items: list[tuple[str, ConfigInput]]) -> list[AnalysisResponse]:
+    """CPU-bound batched inference in thread pool.
+
+    Each enabled task runs once per language over the de-duplicated texts of
+    every item that requested it, or that requested a task depending on it.
+    Tasks run in stages of the dependency graph: independent (task, language)
+    runs of a stage execute concurrently, up to MAX_TASK_CONCURRENCY at a
+    time, and later stages consume their results. Results and warnings are
+    returned per item, in input order.
+    """
+
+    responses: list[dict] = [{} for _ in items]
+    # Texts are preprocessed and tokenized once for all the models sharing a tokenizer
+    encodings = SharedEncodings()
+    # One unit per (task, language, long_text): the indices of the items that
+    # asked for it and the unique texts it runs on, some only needed downstream
+    units: dict[tuple[str, str, bool], tuple[list[int], dict[str, int]]] = {}
+
+    for task in TASKS:
+        indices = [i for i, (_, config) in enumerate(items) if getattr(config, task)]
+
+        if task == "targeted_sentiment":
+            for i in [i for i in indices if items[i][1].lang != "es"]:
+                responses[i].setdefault("warnings", []).append("Targeted sentiment analysis is only available in Spanish (es). Skipping.")
+            indices = [i for i in indices if items[i][1].lang == "es"]
+
+        for i in indices:
+            text, config = items[i]
+            unit_indices, positions = units.setdefault((task, config.lang, config.long_text), ([], {}))
+            unit_indices.append(i)
+            # Deduplicate texts, keeping first-seen order
+            positions.setdefault(text, len(positions))
+
+    for (task, lang, long_text), (_, positions) in list(units.items()):
+        for upstream in DEPENDENCIES.get(task, ()):
+            _, upstream_positions = units.setdefault((upstream, lang, long_text), ([], {}))
+            for text in positions:
+                upstream_positions.setdefault(text, len(upstream_positions))
+
+    outputs: dict[tuple[str, str, bool], list[dict]] = {}
+
+    def unit_job(key: tuple[str, str, bool]) -> Callable[[], list[dict]]:
+        task, lang, long_text = key
+        texts = list(units[key][1])
+        if task == "targeted_sentiment":
+            ner_key = ("ner", lang, long_text)
+            ner_positions = units[ner_key][1]
+            ner_results = [outputs[ner_key][ner_positions[text]] for text in texts]
+            return partial(_analyze_targets, lang, texts, ner_results)
+        return partial(_analyze_task, task, lang, texts, encodings, long_text)
+
+    # Units that failed without failing the request, so their dependents are skipped
+    failed: dict[tuple[str, str, bool], Exception] = {}
+
+    for depth in sorted({_depth(task) for task, _, _ in units}):
+        stage = [key for key in units if _depth(key[0]) == depth]
+        blocked = {}
+        for key in stage:
+            for upstream in DEPENDENCIES.get(key[0], ()):
+                if (upstream, key[1], key[2]) in failed:
+                    blocked[key] = (upstream, failed[(upstream, key[1], key[2])])
+        for key, (upstream, error) in blocked.items():
+            failed[key] = error
+            for i in units[key][0]:
+                responses[i].setdefault("warnings", []).append(
+                    f"Skipped {key[0]}: the {upstream} model it depends on failed to load or run: {error}"
+                )
+        runnable = [key for key in stage if key not in blocked]
+        outcomes = _run_limited([unit_job(key) for key in runnable], settings.MAX_TASK_CONCURRENCY)
+
+        for key, (results, error) in zip(runnable, outcomes):
+            task = key[0]
+            indices, positions = units[key]
+            if error is not None:
+                # Tasks only run to feed another one fail their dependents, not the request
+                if indices and task != "targeted_sentiment":
+                    raise error
+                failed[key] = error
+                for i in indices:
+                    responses[i].setdefault("warnings", []).append(f"Targeted sentiment model failed to load or run: {error}")
+                continue
+            outputs[key] = results
+            for i in indices:
+                text, config = items[i]
+                result = results[positions[text]]
+                if task == "targeted_sentiment" and not result["targets"]:
+                    responses[i].setdefault("warnings", []).append("Targeted sentiment found no entities to score in the text.")
+                if config.labels_only or config.top_k is not None or config.round_probas is not None:
+                    result = _shape_result(result, config)
+                responses[i][task] = result
+
+    return responses
+
+def _run_analysis(text: str, config: ConfigInput) -> AnalysisResponse:
+    """CPU-bound inference in thread pool"""
+    return _run_batch_analysis([(text, config)])[0]
@@ -0,0 +1,36 @@
+import csv
+import json
+from typing import Iterator
+
+# Fields tried, in order, when a record does not name its text field
+TEXT_FIELDS = ("text", "body")
+
+def iter_records(path: str) -> Iterator[dict]:
+    """Yield records from a JSONL or CSV file, one dict per line or row."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def record_text(record: dict, text_field: str | None = None) -> str:
+    """Extract the text of a record from `text_field` or the first known text field."""
+    if text_field:
+        if text_field not in record:
+            raise KeyError(f"Record has no field '{text_field}'")
+        return record[text_field]
+    for field in TEXT_FIELDS:
+        if record.get(field):
+            return record[field]
+    raise KeyError(f"Record has none of the text fields {TEXT_FIELDS}")
+
+def read_texts(path: str, limit: int | None = None, text_field: str | None = None) -> list[str]:
+    """Read up to `limit` texts from a JSONL or CSV file."""
+    texts = []
+    for record in iter_records(path):
+        texts.append(record_text(record, text_field))
+        if limit is not None and len(texts) >= limit:
+            break
+    return texts
@@ -0,0 +1,57 @@
+import os
+import resource
+
+# smaps_rollup fields reported, in kB
+_SMAPS_FIELDS = {
+    "Rss": "rss_mb",
+    "Pss": "pss_mb",
+    "Shared_Clean": "shared_clean_mb",
+    "Shared_Dirty": "shared_dirty_mb",
+    "Private_Clean": "private_clean_mb",
+    "Private_Dirty": "private_dirty_mb",
+}
+
+def process_memory(pid: int | None = None) -> dict:
+    """
+    Memory of a process in MB.
+
+    On Linux this reads /proc/<pid>/smaps_rollup, where `pss_mb` splits shared
+    pages evenly between the processes mapping them and `shared_*` shows pages
+    still shared copy-on-write. Elsewhere only the peak RSS of this process is known.
+    """
+    pid = pid or os.getpid()
+    info: dict = {"pid": pid}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in _SMAPS_FIELDS:
+                    info[_SMAPS_FIELDS[name]] = round(int(rest.split()[0]) / 1024, 1)
+    except OSError:
+        if pid == os.getpid():
+            # ru_maxrss is in kB on Linux
+            info["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        return info
+    info["shared_mb"] = round(info.get("shared_clean_mb", 0) + info.get("shared_dirty_mb", 0), 1)
+    info["private_mb"] = round(info.get("private_clean_mb", 0) + info.get("private_dirty_mb", 0), 1)
+    return info
+
+def child_pids(parent: int) -> list[int]:
+    """PIDs of the direct children of `parent`, found by scanning /proc."""
+    pids = []
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return pids
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="utf-8") as f:
+                # The command name may contain spaces, so split after its closing parenthesis
+                fields = f.read().rpartition(")")[2].split()
+        except OSError:
+            continue
+        if int(fields[1]) == parent:
+            pids.append(int(entry))
+    return sorted(pids)
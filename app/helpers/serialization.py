@@ -0,0 +1,72 @@
+"""
+Response encoding for analysis results.
+
+Results are built by the service itself, so they are encoded directly instead
+of being validated again against the response models. JSON is encoded with
+orjson when it is installed, and MessagePack is served to clients that ask for
+it in `Accept` when msgpack is installed.
+"""
+import json
+from typing import Any
+
+from fastapi import Response
+
+from app.models.schemas import AnalysisResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/msgpack"
+# Media types clients use to ask for MessagePack
+MSGPACK_TYPES = (MSGPACK_TYPE, "application/x-msgpack", "application/vnd.msgpack")
+
+# Every response field with its default, in schema order
+_DEFAULTS = {
+    name: field.get_default(call_default_factory=True)
+    for name, field in AnalysisResponse.model_fields.items()
+}
+
+def response_dict(result: dict) -> dict:
+    """An analysis result with every AnalysisResponse field present, as the response model would dump it."""
+    return {name: result.get(name, list(default) if isinstance(default, list) else default) for name, default in _DEFAULTS.items()}
+
+def _default(value: Any) -> Any:
+    # numpy scalars and arrays coming from model outputs
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+def dumps(content: Any) -> bytes:
+    """Encode content as compact UTF-8 JSON."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+def packb(content: Any) -> bytes:
+    """Encode content as MessagePack. Requires msgpack."""
+    return msgpack.packb(content, default=_default)
+
+def wants_msgpack(accept: str | None) -> bool:
+    """Whether the Accept header asks for MessagePack and it can be served."""
+    if msgpack is None or not accept:
+        return False
+    return any(part.split(";")[0].strip().lower() in MSGPACK_TYPES for part in accept.split(","))
+
+def encode(content: Any, accept: str | None = None) -> tuple[bytes, str]:
+    """Encode content as MessagePack or JSON depending on the Accept header, returning the body and its media type."""
+    if wants_msgpack(accept):
+        return packb(content), MSGPACK_TYPE
+    return dumps(content), JSON_TYPE
+
+def render(content: Any, accept: str | None = None, status_code: int = 200) -> Response:
+    """Encode content as MessagePack or JSON depending on the Accept header."""
+    body, media_type = encode(content, accept)
+    return Response(body, status_code=status_code, media_type=media_type, headers={"Vary": "Accept"})
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from pydantic import ValidationError
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from starlette.websockets import WebSocket
+
+from app.helpers import serialization
+from app.helpers.serialization import dumps, packb, response_dict
+from app.models.schemas import ConfigInput, TextInput
+
+logger = logging.getLogger(__name__)
+
+class DuplexStreamingResponse(StreamingResponse):
+    """StreamingResponse whose body generator keeps reading the request body.
+
+    Starlette normally listens on `receive` for a disconnect while streaming,
+    which would swallow the request body chunks the generator still needs. Here
+    the request stream itself reports the disconnect instead.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self.stream_response(send)
+        except (ClientDisconnect, OSError):
+            logger.info("Client disconnected during a streamed response")
+            return
+        if self.background is not None:
+            await self.background()
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[bytes]:
+    """Split a byte stream into lines, holding at most one partial line in memory."""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+        if len(buffer) > max_line_bytes:
+            raise ValueError(f"Line longer than {max_line_bytes} bytes")
+    if buffer:
+        yield buffer
+
+def validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc']) or 'record'}: {err['msg']}" for err in error.errors()
+    )
+
+def parse_record(line: bytes) -> TextInput:
+    """Parse one NDJSON line into a TextInput, raising ValueError with a readable message."""
+    try:
+        return TextInput.model_validate_json(line)
+    except ValidationError as e:
+        raise ValueError(validation_message(e)) from None
+
+async def analyze_ndjson(
+    chunks: AsyncIterator[bytes],
+    run_batch: Callable[[list[tuple[str, ConfigInput]]], Awaitable[list[dict]]],
+    chunk_size: int,
+    max_line_bytes: int,
+    max_in_flight: int = 2,
+) -> AsyncIterator[bytes]:
+    """Analyze an NDJSON stream of TextInput records, yielding NDJSON results in input order.
+
+    Records are analyzed in chunks of `chunk_size`. A reader task keeps parsing
+    the upload while earlier chunks are analyzed, with at most `max_in_flight`
+    chunks held in memory, and each chunk's results are written as soon as it
+    finishes. Invalid records and failed chunks produce
+    `{"index": i, "error": ...}` lines instead of aborting the stream.
+    """
+
+    def encode(record: dict) -> bytes:
+        return dumps(record) + b"\n"
+
+    def start(entries: list[tuple[int, TextInput | str]]) -> asyncio.Future | None:
+        items = [(entry.text, entry.config) for _, entry in entries if not isinstance(entry, str)]
+        return asyncio.ensure_future(run_batch(items)) if items else None
+
+    # Bounded, so a fast upload waits for analysis instead of piling up in memory
+    pending: asyncio.Queue = asyncio.Queue(maxsize=max_in_flight)
+
+    async def read():
+        entries: list[tuple[int, TextInput | str]] = []
+        index = 0
+        try:
+            async for line in iter_lines(chunks, max_line_bytes):
+                if not line.strip():
+                    continue
+                try:
+                    entries.append((index, parse_record(line)))
+                except ValueError as e:
+                    entries.append((index, str(e)))
+                index += 1
+                if len(entries) >= chunk_size:
+                    await pending.put((entries, start(entries)))
+                    entries = []
+        except ValueError as e:
+            # The body itself is unusable from here on (e.g. an oversized line)
+            entries.append((index, str(e)))
+        finally:
+            if entries:
+                await pending.put((entries, start(entries)))
+            await pending.put(None)
+
+    reader = asyncio.ensure_future(read())
+    try:
+        while (chunk := await pending.get()) is not None:
+            entries, task = chunk
+            results: list[dict] = []
+            error = None
+            if task is not None:
+                try:
+                    results = await task
+                except Exception as e:
+                    logger.exception("Streaming chunk failed")
+                    error = str(e)
+            results_iter = iter(results)
+            for index, entry in entries:
+                if isinstance(entry, str):
+                    yield encode({"index": index, "error": entry})
+                elif error is not None:
+                    yield encode({"index": index, "error": error})
+                else:
+                    yield encode({"index": index, **response_dict(next(results_iter))})
+        # Surface a client disconnect raised while reading the body
+        await reader
+    finally:
+        reader.cancel()
+
+class _InvalidMessage(ValueError):
+    def __init__(self, message_id: Any, message: str):
+        super().__init__(message)
+        self.message_id = message_id
+
+def _decode_message(raw: str | bytes, binary: bool) -> tuple[Any, TextInput]:
+    """Split a WebSocket message into its id and TextInput, raising ValueError with a readable message.
+
+    The id is returned even when the rest of the message is invalid, as long as it could be decoded.
+    """
+    if binary:
+        if serialization.msgpack is None:
+            raise ValueError("Binary messages are MessagePack, which needs `pip install msgpack` on the server")
+        data = serialization.msgpack.unpackb(raw)
+    else:
+        data = json.loads(raw)
+    if not isinstance(data, dict):
+        raise ValueError("Message is not an object")
+    message_id = data.pop("id", None)
+    try:
+        return message_id, TextInput.model_validate(data)
+    except ValidationError as e:
+        raise _InvalidMessage(message_id, validation_message(e)) from None
+
+async def analyze_websocket(
+    websocket: WebSocket,
+    run_batch: Callable[[list[tuple[str, ConfigInput]]], Awaitable[list[dict]]],
+    window: int,
+    max_batch_size: int,
+    max_message_bytes: int,
+    batches_in_flight: int = 2,
+):
+    """Analyze id-tagged messages from an accepted WebSocket, replying as each batch finishes.
+
+    Messages are `{"id": ..., "text": ..., "config": {...}}`, as JSON text frames
+    or MessagePack binary frames, and each reply uses the frame type of its
+    message. Once `window` messages are in flight the connection is no longer
+    read, so a fast client is held back by TCP flow control. Up to
+    `batches_in_flight` batches run at once; messages arriving meanwhile queue
+    up and go out together in the next batch of up to `max_batch_size`, so
+    replies can come back out of order. Invalid messages and failed batches get
+    `{"id": ..., "error": ...}` replies instead of closing the connection.
+    """
+    slots = asyncio.Semaphore(window)
+    running = asyncio.Semaphore(batches_in_flight)
+    queue: asyncio.Queue = asyncio.Queue()
+    send_lock = asyncio.Lock()
+    batches: set[asyncio.Task] = set()
+
+    async def send(reply: dict, binary: bool):
+        async with send_lock:
+            if binary:
+                await websocket.send_bytes(packb(reply))
+            else:
+                await websocket.send_text(dumps(reply).decode("utf-8"))
+
+    async def analyze(entries: list[tuple[Any, TextInput, bool]]):
+        try:
+            try:
+                results = await run_batch([(entry.text, entry.config) for _, entry, _ in entries])
+                replies = [{"id": message_id, **response_dict(result)} for (message_id, _, _), result in zip(entries, results)]
+            except Exception as e:
+                error: dict = {"error": str(e)}
+                if getattr(e, "retry_after", None) is not None:
+                    error["retry_after"] = e.retry_after
+                else:
+                    logger.exception("WebSocket batch failed")
+                replies = [{"id": message_id, **error} for message_id, _, _ in entries]
+            for (_, _, binary), reply in zip(entries, replies):
+                await send(reply, binary)
+                slots.release()
+        finally:
+            running.release()
+
+    async def dispatch():
+        while True:
+            # Wait for a free batch first, so messages keep queueing while the others run
+            await running.acquire()
+            entries = [await queue.get()]
+            while len(entries) < max_batch_size and not queue.empty():
+                entries.append(queue.get_nowait())
+            batch = asyncio.ensure_future(analyze(entries))
+            batches.add(batch)
+            batch.add_done_callback(batches.discard)
+
+    await send({"type": "ready", "window": window, "max_batch_size": max_batch_size}, False)
+    dispatcher = asyncio.ensure_future(dispatch())
+    try:
+        while True:
+            await slots.acquire()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            binary = message.get("bytes") is not None
+            raw = message["bytes"] if binary else message.get("text") or ""
+            message_id = None
+            try:
+                if len(raw) > max_message_bytes:
+                    raise ValueError(f"Message longer than {max_message_bytes} bytes")
+                message_id, entry = _decode_message(raw, binary)
+            except ValueError as e:
+                message_id = getattr(e, "message_id", None)
+                await send({"id": message_id, "error": str(e)}, binary)
+                slots.release()
+                continue
+            queue.put_nowait((message_id, entry, binary))
+    finally:
+        dispatcher.cancel()
+        for batch in list(batches):
+            batch.cancel()
+        await asyncio.gather(dispatcher, *batches, return_exceptions=True)
@@ -1,12 +1,22 @@
 from enum import Enum
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
+
+SUPPORTED_LANGS = ("es", "en", "it", "pt")
+
+def match_lang(value: str) -> str | None:
+    """Map a language code or locale (e.g. 'es', 'es_AR', 'pt-BR', 'en.UTF-8') to a supported language."""
+    value = value.lower()
+    for lang in SUPPORTED_LANGS:
+        if value == lang or value.startswith((f"{lang}_", f"{lang}-", f"{lang}.")):
+            return lang
+    return None
 
 class ConfigInput(BaseModel):
     """Configuration for text analysis options."""
 
     lang: str = Field(
         default="es",
-        description="Language code for analysis (e.g., 'es' for Spanish, 'en' for English)",
+        description="Language code for analysis (e.g., 'es' for Spanish, 'en' for English). Supported: es, en, it, pt",
         examples=["es", "en"]
     )
     sentiment: bool = Field(
@@ -35,9 +45,38 @@ class ConfigInput(BaseModel):
     )
     targeted_sentiment: bool = Field(
         default=False,
-        description="Enable targeted sentiment analysis (sentiment towards specific entities)"
+        description="Enable targeted sentiment analysis: the sentiment towards each entity NER finds in the text (Spanish only)"
+    )
+    long_text: bool = Field(
+        default=False,
+        description="Analyze texts longer than the models' maximum length in overlapping windows instead of "
+        "truncating them. Window probabilities are averaged into one document-level result, and NER/POS "
+        "tokens and entities are merged across windows"
+    )
+    labels_only: bool = Field(
+        default=False,
+        description="Return only the `label` of sentiment, emotion, hate_speech, irony and targeted_sentiment, without `probas`"
+    )
+    top_k: int | None = Field(
+        default=None,
+        ge=1,
+        description="Return only the k most likely labels in `probas`"
+    )
+    round_probas: int | None = Field(
+        default=None,
+        ge=0,
+        le=8,
+        description="Round `probas` to this many decimal places"
     )
 
+    @field_validator("lang", mode="before")
+    @classmethod
+    def normalize_lang(cls, v: str) -> str:
+        lang = match_lang(str(v))
+        if lang is None:
+            raise ValueError(f"Unsupported language '{v}'. Supported: {', '.join(SUPPORTED_LANGS)}")
+        return lang
+
     model_config = {
         "json_schema_extra": {
             "examples": [
@@ -89,6 +128,35 @@ class TextInput(BaseModel):
         }
     }
 
+class BatchTextInput(BaseModel):
+    """Input schema for batch text analysis request."""
+
+    items: list[TextInput] = Field(
+        ...,
+        description="Texts to analyze, each with its own configuration. Results are returned in the same order",
+        min_length=1,
+        max_length=1000,
+    )
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "items": [
+                        {
+                            "text": "Me encanta este producto, es increíble!",
+                            "config": {"lang": "es", "sentiment": True}
+                        },
+                        {
+                            "text": "El envío llegó tarde y roto.",
+                            "config": {"lang": "es", "sentiment": True, "emotion": True}
+                        }
+                    ]
+                }
+            ]
+        }
+    }
+
 class TokenOutput(BaseModel):
     """Output schema for token-level analysis (NER, POS)."""
 
@@ -201,7 +269,8 @@ class AnalysisResponse(BaseModel):
     )
     targeted_sentiment: dict | None = Field(
         default=None,
-        description="Targeted sentiment analysis results for specific entities"
+        description="Sentiment towards each entity found by NER in the text, scored once per distinct entity",
+        examples=[{"targets": [{"target": "banco Pirulín", "type": "ORG", "label": "NEU", "probas": {"NEG": 0.1, "NEU": 0.8, "POS": 0.1}}]}]
     )
     warnings: list[str] = Field(
         default_factory=list,
@@ -225,6 +294,51 @@ class AnalysisResponse(BaseModel):
         }
     }
 
+class BatchAnalysisResponse(BaseModel):
+    """Batch analysis response, one result per input item in input order."""
+
+    results: list[AnalysisResponse] = Field(
+        description="Analysis results in the same order as the request items"
+    )
+
+class JobInput(BaseModel):
+    """Input schema for an asynchronous analysis job."""
+
+    texts: list[str] = Field(
+        ...,
+        description="Texts to analyze. Upload a JSONL file to `/jobs/upload` for larger datasets",
+        min_length=1,
+    )
+    config: ConfigInput = Field(
+        default_factory=ConfigInput,
+        description="Analysis configuration applied to every text"
+    )
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "texts": ["Me encanta este producto, es increíble!", "El envío llegó tarde y roto."],
+                    "config": {"lang": "es", "sentiment": True, "hate_speech": True}
+                }
+            ]
+        }
+    }
+
+class JobStatus(BaseModel):
+    """State and progress of an asynchronous analysis job."""
+
+    id: str = Field(description="Job identifier")
+    status: str = Field(description="queued, running, completed, failed or cancelled")
+    total: int = Field(description="Texts in the job")
+    processed: int = Field(description="Texts analyzed so far, failed ones included")
+    errors: int = Field(description="Texts that could not be analyzed")
+    config: ConfigInput = Field(description="Analysis configuration of the job")
+    created_at: float = Field(description="Unix time the job was submitted")
+    started_at: float | None = Field(default=None, description="Unix time the job first started running")
+    finished_at: float | None = Field(default=None, description="Unix time the job finished")
+    error: str | None = Field(default=None, description="Why the job failed, when it did")
+
 class Device(str, Enum):
     """Enum for device types."""
 
@@ -1,12 +1,134 @@
 import asyncio
-from fastapi import APIRouter, HTTPException
-from app.models.schemas import TextInput, AnalysisResponse
-from app.core.config import executor
-from app.helpers.analysis import _run_analysis
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Literal
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.models.schemas import TextInput, AnalysisResponse, BatchTextInput, BatchAnalysisResponse, ConfigInput
+from app.core import metrics, server
+from app.core.profiling import Profile, use_profile
+from app.core.config import settings
+from app.core.timing import startup_timer
+from app.helpers.analysis import TASKS, _run_analysis, _run_batch_analysis
+from app.helpers.memory import child_pids, process_memory
+from app.helpers.serialization import MSGPACK_TYPE, encode, render, response_dict
+from app.helpers.streaming import DuplexStreamingResponse, analyze_ndjson, analyze_websocket
 from app.services.analyzer import analyzer_service
+from app.services.cache import disk_cache, prediction_cache
+from app.services.scheduler import DeadlineExceededError, QueueFullError, scheduler
 
 router = APIRouter()
 
+# Sampled JSON lines of request metadata. Never carries the texts themselves
+request_logger = logging.getLogger("app.requests")
+
+Priority = Literal["interactive", "bulk"]
+
+# Content negotiation of the analysis endpoints
+ACCEPT_HEADER = Header(
+    None,
+    description=f"`{MSGPACK_TYPE}` for a MessagePack response (requires `pip install msgpack` on the server), JSON otherwise",
+)
+
+OVERLOAD_RESPONSES = {
+    429: {
+        "description": "The priority lane's queue is full. Retry after the `Retry-After` header's seconds",
+        "content": {
+            "application/json": {"example": {"detail": "The interactive queue is full. Retry in 2s"}}
+        },
+    },
+    503: {
+        "description": "The request waited in the queue longer than its lane's deadline",
+        "content": {
+            "application/json": {"example": {"detail": "Request waited 10.2s in the interactive queue and was dropped"}}
+        },
+    },
+}
+
+
+def _describe(items: list[tuple[str, ConfigInput]]) -> dict:
+    """Request metadata for the request log: sizes, tasks and languages, no text."""
+    return {
+        "texts": len(items),
+        "chars": sum(len(text) for text, _ in items),
+        "tasks": [task for task in TASKS if any(getattr(config, task) for _, config in items)],
+        "langs": sorted({config.lang for _, config in items}),
+    }
+
+
+@contextmanager
+def _observe_request(endpoint: str, **fields: Any) -> Iterator[None]:
+    """Count a request by status code, record its latency and maybe log its metadata.
+
+    A `LOG_SAMPLE_RATE` fraction of requests is logged, plus every server error
+    and every request slower than `LOG_SLOW_REQUEST_MS`.
+    """
+    start = time.perf_counter()
+    code = status.HTTP_200_OK
+    try:
+        yield
+    except HTTPException as e:
+        code = e.status_code
+        raise
+    except Exception:
+        code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.REQUESTS.inc(endpoint=endpoint, status=code)
+        metrics.REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+        slow = settings.LOG_SLOW_REQUEST_MS is not None and elapsed * 1000 >= settings.LOG_SLOW_REQUEST_MS
+        if request_logger.isEnabledFor(logging.INFO) and (
+            code >= 500 or slow or random.random() < settings.LOG_SAMPLE_RATE
+        ):
+            request_logger.info(json.dumps({
+                "endpoint": endpoint,
+                "status": code,
+                "duration_ms": round(elapsed * 1000, 1),
+                **fields,
+            }))
+
+
+async def _profiled_analysis(lane: str, input_data: TextInput, accept: str | None) -> Response:
+    """Run `/analyze` with every stage timed, returning the timings with the result."""
+    profile = Profile()
+    start = time.perf_counter()
+
+    def job():
+        profile.add("queue_wait", time.perf_counter() - start)
+        with use_profile(profile):
+            return _run_analysis(input_data.text, input_data.config)
+
+    result = await _schedule(lane, job)
+    serialize_start = time.perf_counter()
+    payload = response_dict(result)
+    # Timed in the negotiated format. The response adds the small timings field to it
+    encode(payload, accept)
+    profile.add("serialization", time.perf_counter() - serialize_start)
+    profile.add("total", time.perf_counter() - start)
+    return render({**payload, "timings": profile.rounded()}, accept)
+
+
+async def _schedule(lane: str, fn: Callable[..., Any], *args: Any) -> Any:
+    """Run `fn(*args)` on the inference scheduler, turning overload into 429/503 responses."""
+    try:
+        return await asyncio.wrap_future(scheduler.submit(lane, fn, *args))
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        ) from e
+    except DeadlineExceededError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        ) from e
+
 
 @router.post(
     "/analyze",
@@ -28,6 +150,19 @@ router = APIRouter()
     **Note:** Models are loaded on-demand if not already loaded. 
     The analysis is performed asynchronously using a thread pool for optimal performance.
     
+    **Output:** `labels_only`, `top_k` and `round_probas` in `config` shrink the
+    `probas` of the classification tasks. Send `Accept: application/msgpack`
+    for a MessagePack body instead of JSON.
+    
+    **Profiling:** With `?profile=true` the response also carries `timings`, the
+    milliseconds spent per stage: `queue_wait`, `preprocessing`, one
+    `model:<task>` per forward pass, `serialization` and `total`.
+    
+    **Priority:** Requests run in the `interactive` lane unless the `X-Priority`
+    header or the `priority` query parameter says `bulk`. Interactive requests are
+    always scheduled first. When a lane's queue is full the request is rejected
+    right away with `429` and a `Retry-After` header.
+    
     **Example Request:**
     ```json
     {
@@ -76,6 +211,7 @@ router = APIRouter()
                 }
             },
         },
+        **OVERLOAD_RESPONSES,
         500: {
             "description": "Internal server error during analysis",
             "content": {
@@ -84,22 +220,217 @@ router = APIRouter()
         },
     },
 )
-async def analyze_text(input_data: TextInput):
+async def analyze_text(
+    input_data: TextInput,
+    priority: Priority | None = Query(None, description="Scheduling lane. Overrides `X-Priority`"),
+    x_priority: Priority | None = Header(None, description="Scheduling lane, `interactive` by default"),
+    profile: bool = Query(False, description="Return per-stage `timings` in milliseconds with the result"),
+    accept: str | None = ACCEPT_HEADER,
+):
     """
     Analyze text using configured NLP models.
 
     This endpoint processes text through the requested analysis models and returns
-    comprehensive results. The inference is offloaded to a thread pool to keep the
-    async event loop responsive.
+    comprehensive results. The inference is offloaded to the scheduler's threads to
+    keep the async event loop responsive.
+    """
+    lane = priority or x_priority or "interactive"
+    fields = _describe([(input_data.text, input_data.config)])
+    with _observe_request("/analyze", lane=lane, profile=profile, **fields):
+        try:
+            if profile:
+                return await _profiled_analysis(lane, input_data, accept)
+            result = await _schedule(lane, _run_analysis, input_data.text, input_data.config)
+            return render(response_dict(result), accept)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+@router.post(
+    "/analyze/batch",
+    response_model=BatchAnalysisResponse,
+    tags=["Analysis"],
+    summary="Analyze a batch of texts with NLP models",
+    description="""
+    Analyze many texts in a single request.
+    
+    Each item carries its own text and configuration, exactly like `/analyze`.
+    Duplicate texts are analyzed only once, and every enabled task runs as a
+    single batched call per model instead of one call per text.
+    
+    Results are returned in the same order as the request items, each with
+    its own `warnings`.
+    
+    Batches run in the `bulk` lane unless `X-Priority` or `priority` say
+    `interactive`, and get `429` with `Retry-After` when the lane is full.
+    
+    **Example Request:**
+    ```json
+    {
+      "items": [
+        {"text": "Me encanta este producto, es increíble!", "config": {"sentiment": true}},
+        {"text": "El envío llegó tarde y roto.", "config": {"sentiment": true, "emotion": true}}
+      ]
+    }
+    ```
+    """,
+    responses={
+        **OVERLOAD_RESPONSES,
+        500: {
+            "description": "Internal server error during analysis",
+            "content": {
+                "application/json": {"example": {"detail": "Model inference failed"}}
+            },
+        },
+    },
+)
+async def analyze_batch(
+    input_data: BatchTextInput,
+    priority: Priority | None = Query(None, description="Scheduling lane. Overrides `X-Priority`"),
+    x_priority: Priority | None = Header(None, description="Scheduling lane, `bulk` by default"),
+    accept: str | None = ACCEPT_HEADER,
+):
+    """
+    Analyze a batch of texts using configured NLP models.
+
+    The whole batch is scheduled as one job so that each model runs a single
+    padded forward pass over all the texts that requested it.
     """
+    lane = priority or x_priority or "bulk"
+    items = [(item.text, item.config) for item in input_data.items]
+    with _observe_request("/analyze/batch", lane=lane, **_describe(items)):
+        try:
+            results = await _schedule(lane, _run_batch_analysis, items)
+            return render({"results": [response_dict(result) for result in results]}, accept)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+@router.post(
+    "/analyze/stream",
+    tags=["Analysis"],
+    summary="Analyze a streamed NDJSON upload",
+    description="""
+    Analyze an arbitrarily large upload of newline-delimited JSON records.
+    
+    The request body is NDJSON (`application/x-ndjson`), one `/analyze` request
+    body (`{"text": ..., "config": {...}}`) per line. The response is NDJSON too,
+    one `/analyze` response per record in input order, tagged with its zero-based
+    `index`. Invalid records produce `{"index": i, "error": "..."}` lines.
+    
+    Records are processed in chunks of `STREAM_CHUNK_SIZE` as the upload arrives,
+    so memory stays flat and results start streaming back before the upload finishes.
+    Chunks run in the `bulk` lane. When it is full, the stream waits for room
+    (slowing down the upload) instead of failing.
+    
+    **Example:**
+    ```bash
+    curl -X POST http://localhost:8000/analyze/stream \\
+      -H "Content-Type: application/x-ndjson" --data-binary @corpus.jsonl
+    ```
+    """,
+    responses={
+        200: {
+            "description": "NDJSON stream of analysis results",
+            "content": {
+                "application/x-ndjson": {
+                    "example": '{"index": 0, "sentiment": {"label": "POS", "probas": {"NEG": 0.003, "NEU": 0.019, "POS": 0.978}}, '
+                               '"emotion": null, "hate_speech": null, "irony": null, "ner": null, "pos": null, '
+                               '"targeted_sentiment": null, "warnings": []}\n'
+                               '{"index": 1, "error": "text: String should have at least 1 character"}\n'
+                }
+            },
+        },
+    },
+)
+async def analyze_stream(
+    request: Request,
+    priority: Priority | None = Query(None, description="Scheduling lane. Overrides `X-Priority`"),
+    x_priority: Priority | None = Header(None, description="Scheduling lane, `bulk` by default"),
+):
+    """
+    Analyze a streamed NDJSON body, streaming NDJSON results back.
+
+    Each chunk runs through the same batched pipeline as `/analyze/batch` on the
+    scheduler, while the next chunk is being read from the request.
+    """
+    lane = priority or x_priority or "bulk"
+
+    async def run_batch(items):
+        while True:
+            try:
+                return await asyncio.wrap_future(scheduler.submit(lane, _run_batch_analysis, items))
+            except QueueFullError as e:
+                await asyncio.sleep(min(e.retry_after, 1))
+
+    # Only the stream's start is timed: its duration depends on the upload
+    with _observe_request("/analyze/stream", lane=lane):
+        return DuplexStreamingResponse(
+            analyze_ndjson(
+                request.stream(),
+                run_batch,
+                chunk_size=settings.STREAM_CHUNK_SIZE,
+                max_line_bytes=settings.STREAM_MAX_LINE_BYTES,
+            ),
+            media_type="application/x-ndjson",
+        )
+
+
+@router.websocket("/ws/analyze")
+async def analyze_socket(
+    websocket: WebSocket,
+    priority: Priority | None = Query(None, description="Scheduling lane. Overrides `X-Priority`"),
+    x_priority: Priority | None = Header(None, description="Scheduling lane, `interactive` by default"),
+):
+    """
+    Analyze id-tagged messages over one long-lived WebSocket connection.
+
+    After a `{"type": "ready", "window": n, ...}` greeting, the client sends
+    `{"id": ..., "text": ..., "config": {...}}` messages without waiting for
+    replies, and gets `{"id": ..., <analysis response>}` or
+    `{"id": ..., "error": ...}` back as results finish, possibly out of order.
+    Messages queued on a connection are analyzed together through the same
+    batched pipeline as `/analyze/batch`.
+    """
+    lane = priority or x_priority or "interactive"
+
+    async def run_batch(items):
+        start = time.perf_counter()
+        code = status.HTTP_200_OK
+        try:
+            return await asyncio.wrap_future(scheduler.submit(lane, _run_batch_analysis, items))
+        except QueueFullError:
+            code = status.HTTP_429_TOO_MANY_REQUESTS
+            raise
+        except DeadlineExceededError:
+            code = status.HTTP_503_SERVICE_UNAVAILABLE
+            raise
+        except Exception:
+            code = status.HTTP_500_INTERNAL_SERVER_ERROR
+            raise
+        finally:
+            # Counted per message, timed per batch
+            metrics.REQUESTS.inc(len(items), endpoint="/ws/analyze", status=code)
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="/ws/analyze")
+
+    await websocket.accept()
+    metrics.WS_CONNECTIONS.inc()
     try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            executor, _run_analysis, input_data.text, input_data.config
+        await analyze_websocket(
+            websocket,
+            run_batch,
+            window=settings.WS_WINDOW,
+            max_batch_size=settings.WS_MAX_BATCH_SIZE,
+            max_message_bytes=settings.STREAM_MAX_LINE_BYTES,
         )
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) from e
+    except WebSocketDisconnect:
+        pass
+    finally:
+        metrics.WS_CONNECTIONS.inc(-1)
 
 
 @router.get(
@@ -110,8 +441,19 @@ async def analyze_text(input_data: TextInput):
     Check the health status of the API service.
     
     This endpoint returns:
-    - Service status (healthy/unhealthy)
-    - Number of models currently loaded in memory
+    - Service status (healthy/starting/unhealthy) and readiness state
+      (loading, warming_up, ready or failed). Responds with 503 until the
+      default models are loaded and warmed up, so it can be used as a readiness probe
+    - Number of models currently loaded in memory, per task and language
+    - Estimated model memory against the configured budget, plus the
+      full-precision size of models quantized to int8
+    - Prediction cache size and hit/miss counts, in memory and on disk
+    - Scheduler queue depth, running jobs and rejected/expired counts per lane
+    - Startup timing in seconds: imports, settings, each default model load,
+      warm-up and the time until the service was ready
+    - Memory of the worker process that answered (RSS, PSS, shared and private MB).
+      When served by prefork workers (`WORKERS` > 1), every worker is listed, so
+      a large `shared_mb` and small `private_mb` confirm the model weights are shared
     
     Use this endpoint for monitoring and health checks in production deployments.
     """,
@@ -120,21 +462,132 @@ async def analyze_text(input_data: TextInput):
             "description": "Service is healthy",
             "content": {
                 "application/json": {
-                    "example": {"status": "healthy", "models_loaded": 3}
+                    "example": {
+                        "status": "healthy",
+                        "ready": True,
+                        "state": "ready",
+                        "models_loaded": 3,
+                        "models": [
+                            {"task": "sentiment", "lang": "es", "memory_mb": 415.5},
+                            {"task": "emotion", "lang": "es", "memory_mb": 415.5},
+                            {"task": "hate_speech", "lang": "es", "memory_mb": 415.5},
+                        ],
+                        "memory_mb": 1246.5,
+                        "memory_budget_mb": None,
+                        "cache": {
+                            "enabled": True,
+                            "size": 1200,
+                            "max_size": 10000,
+                            "hits": 5400,
+                            "misses": 1200,
+                            "hit_rate": 0.8181818181818182,
+                            "evictions": 0,
+                        },
+                        "disk_cache": {
+                            "enabled": True,
+                            "path": "prediction_cache.db",
+                            "size_mb": 212.4,
+                            "max_mb": 1024.0,
+                            "hits": 1150,
+                            "misses": 50,
+                            "hit_rate": 0.9583333333333334,
+                            "evictions": 0,
+                            "errors": 0,
+                        },
+                        "scheduler": {
+                            "interactive": {"queued": 0, "running": 2, "max_queue": 64, "avg_job_ms": 38.2, "completed": 5120, "rejected": 0, "expired": 0},
+                            "bulk": {"queued": 16, "running": 2, "max_queue": 16, "avg_job_ms": 912.4, "completed": 310, "rejected": 57, "expired": 0},
+                        },
+                        "startup": {
+                            "settings": 0.004, "import": 0.71, "load_models": 6.2,
+                            "load sentiment (es)": 5.1, "load emotion (es)": 5.9, "load hate_speech (es)": 6.2,
+                            "warmup": 0.8, "ready": 7.9,
+                        },
+                        "process": {"pid": 12, "rss_mb": 1510.2, "pss_mb": 420.7, "shared_mb": 1302.4, "private_mb": 207.8},
+                        "workers": [
+                            {"pid": 12, "rss_mb": 1510.2, "pss_mb": 420.7, "shared_mb": 1302.4, "private_mb": 207.8},
+                            {"pid": 13, "rss_mb": 1498.9, "pss_mb": 409.3, "shared_mb": 1302.1, "private_mb": 196.8},
+                        ],
+                    }
                 }
             },
-        }
+        },
+        503: {
+            "description": "Service is starting up or failed to load its models",
+            "content": {
+                "application/json": {
+                    "example": {"status": "starting", "ready": False, "state": "loading", "models_loaded": 1}
+                }
+            },
+        },
     },
 )
 async def health_check():
     """
     Check API health and model status.
 
-    Returns the current health status and the count of loaded models.
+    Returns the current health status, the count of loaded models and
+    prediction cache statistics.
     """
-    loaded_models = list(analyzer_service.models.keys())
-    return {
-        "status": "healthy",
+    loaded_models = []
+    for key in list(analyzer_service.models.keys()):
+        entry = {
+            "task": key[0],
+            "lang": key[1],
+            "memory_mb": round(analyzer_service.model_sizes.get(key, 0) / 1024 / 1024, 1),
+        }
+        if key in analyzer_service.model_float_sizes:
+            entry["float_memory_mb"] = round(analyzer_service.model_float_sizes[key] / 1024 / 1024, 1)
+        loaded_models.append(entry)
+    if analyzer_service.ready:
+        health_status = "healthy"
+    elif analyzer_service.state == "failed":
+        health_status = "unhealthy"
+    else:
+        health_status = "starting"
+    body = {
+        "status": health_status,
+        "ready": analyzer_service.ready,
+        "state": analyzer_service.state,
         "models_loaded": len(loaded_models),
         "models": loaded_models,
+        "memory_mb": round(analyzer_service.memory_usage() / 1024 / 1024, 1),
+        "memory_budget_mb": settings.pysentimiento.MEMORY_BUDGET_MB,
+        "cache": prediction_cache.stats(),
+        # A SQLite query that can wait on another worker's write lock
+        "disk_cache": await asyncio.to_thread(disk_cache.stats),
+        "scheduler": scheduler.stats(),
+        "startup": startup_timer.summary(),
+        "process": process_memory(),
     }
+    if server.parent_pid is not None:
+        body["workers"] = [process_memory(pid) for pid in child_pids(server.parent_pid)]
+    if analyzer_service.startup_error:
+        body["error"] = analyzer_service.startup_error
+    if not analyzer_service.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=body)
+    return body
+
+
+@router.get(
+    "/metrics",
+    tags=["Health"],
+    summary="Prometheus metrics",
+    response_class=PlainTextResponse,
+    description="""
+    Metrics of this process in the Prometheus text exposition format:
+    
+    - Request counts by endpoint and status, and request latency histograms
+    - Per-task inference latency histograms, texts processed and batch sizes
+    - Scheduler queue depth, active threads, queue wait, rejections and expirations per lane
+    - Load duration and estimated memory of every loaded model
+    - Prediction cache lookups, evictions and size, in memory and on disk, when enabled
+    
+    With `WORKERS` > 1 each worker keeps its own metrics.
+    """,
+)
+async def metrics_endpoint():
+    """Render every registered metric for a Prometheus scrape."""
+    # Some samples come from SQLite (job counts), which may wait on another process's write lock
+    body = await asyncio.to_thread(metrics.REGISTRY.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
@@ -0,0 +1,206 @@
+import asyncio
+import json
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
+from pydantic import ValidationError
+
+from app.core.config import settings
+from app.helpers.corpus import record_text
+from app.helpers.serialization import dumps
+from app.helpers.streaming import iter_lines, validation_message
+from app.models.schemas import ConfigInput, JobInput, JobStatus
+from app.services.jobs import FINISHED, job_store
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+# Upload items written to the store per transaction
+UPLOAD_CHUNK = 1000
+
+def _status(job: dict) -> dict:
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "total": job["total"],
+        "processed": job["processed"],
+        "errors": job["errors"],
+        "config": json.loads(job["config"]),
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "error": job["error"],
+    }
+
+async def _get_job(job_id: str) -> dict:
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job {job_id} not found")
+    return job
+
+def _parse_upload_line(line: bytes, text_field: str | None) -> tuple[str | None, str | None]:
+    """(text, error) of one uploaded JSONL record."""
+    try:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError("record is not a JSON object")
+        text = record_text(record, text_field)
+    except KeyError as e:
+        return None, e.args[0]
+    except ValueError as e:
+        return None, str(e)
+    if not isinstance(text, str) or not text:
+        return None, "text is empty"
+    return text, None
+
+
+@router.post(
+    "",
+    response_model=JobStatus,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Submit an analysis job",
+    description="""
+    Queue a list of texts for analysis and return right away with the job id.
+
+    Jobs are stored in a local SQLite database (`JOBS__DB_PATH`) and run in the
+    background in batches of `JOBS__BATCH_SIZE` texts through the `bulk`
+    scheduler lane, so they never hold up interactive requests. They survive
+    restarts and resume where they stopped. Poll `GET /jobs/{id}` for progress
+    and page through `GET /jobs/{id}/results`.
+
+    Up to `JOBS__MAX_INLINE_TEXTS` texts can be sent inline. Upload larger
+    datasets as JSONL to `POST /jobs/upload`.
+    """,
+)
+async def create_job(input_data: JobInput):
+    if len(input_data.texts) > settings.jobs.MAX_INLINE_TEXTS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.jobs.MAX_INLINE_TEXTS} inline texts per job. Use /jobs/upload for larger datasets",
+        )
+    items = [(text, None) if text else (None, "text is empty") for text in input_data.texts]
+    job_id = await asyncio.to_thread(job_store.create, input_data.config, items)
+    return _status(await _get_job(job_id))
+
+
+@router.post(
+    "/upload",
+    response_model=JobStatus,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Submit an analysis job from a JSONL upload",
+    description="""
+    Queue every record of a JSONL request body for analysis. Each line is a
+    JSON object whose text is read from `text_field`, or from `text` then
+    `body`. The body is stored as it streams in, so it can be of any size.
+    Lines that cannot be read become failed results at their index instead of
+    rejecting the job.
+
+    ```bash
+    curl -X POST "http://localhost:8000/jobs/upload?config=%7B%22sentiment%22%3Atrue%7D" \\
+      -H "Content-Type: application/x-ndjson" --data-binary @corpus.jsonl
+    ```
+    """,
+)
+async def upload_job(
+    request: Request,
+    config: str = Query("{}", description="ConfigInput as JSON, applied to every record"),
+    text_field: str | None = Query(None, description="Field holding the text (default: text, then body)"),
+):
+    try:
+        job_config = ConfigInput.model_validate_json(config)
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=validation_message(e)) from None
+
+    # Not claimable until the whole body is stored
+    job_id = await asyncio.to_thread(job_store.create, job_config, [], "uploading")
+    index = 0
+    chunk: list[tuple[str | None, str | None]] = []
+    try:
+        try:
+            async for line in iter_lines(request.stream(), settings.STREAM_MAX_LINE_BYTES):
+                if not line.strip():
+                    continue
+                chunk.append(_parse_upload_line(line, text_field))
+                if len(chunk) >= UPLOAD_CHUNK:
+                    await asyncio.to_thread(job_store.add_items, job_id, index, chunk)
+                    index += len(chunk)
+                    chunk = []
+        except ValueError as e:
+            # The rest of the body is unusable (e.g. an oversized line)
+            chunk.append((None, str(e)))
+        await asyncio.to_thread(job_store.add_items, job_id, index, chunk)
+        index += len(chunk)
+    except BaseException:
+        await asyncio.to_thread(job_store.delete, job_id)
+        raise
+    if index == 0:
+        await asyncio.to_thread(job_store.delete, job_id)
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="The upload contains no records")
+    await asyncio.to_thread(job_store.set_status, job_id, "queued")
+    return _status(await _get_job(job_id))
+
+
+@router.get(
+    "/{job_id}",
+    response_model=JobStatus,
+    summary="Get the status and progress of a job",
+)
+async def get_job(job_id: str):
+    return _status(await _get_job(job_id))
+
+
+@router.get(
+    "/{job_id}/results",
+    summary="Page through the results of a job",
+    description="""
+    Results analyzed so far, in input order from `offset` up to the first text
+    still waiting, at most `limit` of them. Each result is an analysis
+    response with its `index`, or `{"index": i, "error": ...}`. Results can be
+    read while the job runs: request the next page from `next_offset`, which
+    is `null` once the job has finished and every result was returned.
+    """,
+    responses={
+        200: {
+            "content": {
+                "application/json": {
+                    "example": {
+                        "id": "3f1c2b6e9a0d4c1f8e7b5a2d9c6e4f10",
+                        "status": "running",
+                        "offset": 0,
+                        "next_offset": 2,
+                        "results": [
+                            {"index": 0, "sentiment": {"label": "POS", "probas": {"NEG": 0.003, "NEU": 0.019, "POS": 0.978}},
+                             "emotion": None, "hate_speech": None, "irony": None, "ner": None, "pos": None,
+                             "targeted_sentiment": None, "warnings": []},
+                            {"index": 1, "error": "text is empty"},
+                        ],
+                    }
+                }
+            }
+        }
+    },
+)
+async def get_job_results(
+    job_id: str,
+    offset: int = Query(0, ge=0, description="Index of the first result"),
+    limit: int = Query(100, ge=1, le=1000, description="Results per page"),
+):
+    job = await _get_job(job_id)
+    rows = await asyncio.to_thread(job_store.results, job_id, offset, limit)
+    next_offset: int | None = rows[-1][0] + 1 if rows else offset
+    if job["status"] in FINISHED and len(rows) < limit:
+        next_offset = None
+    # Results are stored as JSON already, so they are spliced in rather than decoded and encoded again
+    head = dumps({"id": job_id, "status": job["status"], "offset": offset, "next_offset": next_offset})
+    body = head[:-1] + b',"results":[' + ",".join(output for _, output in rows).encode("utf-8") + b"]}"
+    return Response(body, media_type="application/json")
+
+
+@router.delete(
+    "/{job_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="Cancel a job and delete it with its results",
+)
+async def delete_job(job_id: str):
+    await _get_job(job_id)
+    await asyncio.to_thread(job_store.set_status, job_id, "cancelled")
+    await asyncio.to_thread(job_store.delete, job_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
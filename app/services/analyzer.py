@@ -1,49 +1,401 @@
 import logging
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Dict, Any
-from pysentimiento import create_analyzer
+from app.core import metrics, profiling
 from app.core.config import settings
+from app.core.timing import startup_timer
+from app.models.schemas import Device
+from app.services.backends import (
+    enable_offline_mode,
+    load_safetensors_analyzer,
+    model_memory_bytes,
+    onnx_dir,
+    quantize_dynamic,
+)
+from app.services.batching import MicroBatcher
+from app.services.encoding import (
+    SEQUENCE_CLASSIFICATION_TASKS,
+    SharedEncodings,
+    predict_encoded,
+    predict_windowed,
+    tokenizer_fingerprint,
+)
+from app.services.windows import merge_classifications, merge_tokens, word_windows
 
 
 logger = logging.getLogger(__name__)
 
+ModelKey = tuple[str, str]
+
+# Tasks that can analyze long texts in windows. targeted_sentiment always sees the whole text
+WINDOWED_TASKS = SEQUENCE_CLASSIFICATION_TASKS + ("ner", "pos")
+
+# Short inputs run through each model after loading, covering the single and batched paths
+WARMUP_TEXTS = ["Hola, esto es una prueba.", "@usuario this is a warm-up text #test 🙂"]
+
 class AnalyzerService:
     _instance = None
-    models: Dict[str, Any] = {}
+    # Loaded models keyed by (task, lang), least recently used first
+    models: "OrderedDict[ModelKey, Any]" = OrderedDict()
+    model_sizes: Dict[ModelKey, int] = {}
+    # Full-precision size of models that were quantized on load
+    model_float_sizes: Dict[ModelKey, int] = {}
+    # Seconds each model took to load, including export or quantization
+    load_seconds: Dict[ModelKey, float] = {}
+    # Tokenizer identity of models that can share a request's encodings
+    tokenizer_fingerprints: Dict[ModelKey, str] = {}
+    batchers: Dict[ModelKey, MicroBatcher] = {}
+    # In-flight loads, so concurrent callers wait for one load instead of starting their own
+    _loading: Dict[ModelKey, Future] = {}
+    _lock = threading.RLock()
+    # ONNX-served models whose export failed its parity check before a fork, served with torch instead
+    torch_fallback: set[ModelKey] = set()
+    # Startup progress: idle -> loading -> warming_up -> ready, or failed
+    state: str = "idle"
+    startup_error: str | None = None
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(AnalyzerService, cls).__new__(cls)
         return cls._instance
 
-    def load_models(self):
-        """Load default models defined in settings."""
-        logger.info("Loading default models...")
-        for task in settings.pysentimiento.DEFAULT_MODELS:
-            self._load_model(task)
-        logger.info("Default models loaded successfully.")
-
-    def _load_model(self, task: str):
-        if task not in self.models:
-            logger.info("Loading model: %s", task)
-            try:
-                self.models[task] = create_analyzer(task=task, lang=settings.pysentimiento.LANG)
-            except Exception as e:
-                logger.error("Failed to load model %s: %s", task, e)
-                raise e
-
-    def get_model(self, task: str):
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def load_models(self, warmup: bool | None = None, fork_safe: bool = False):
+        """Load default models defined in settings in parallel, then optionally warm them up.
+
+        `warmup` overrides PYSENTIMIENTO__WARMUP. With `fork_safe`, as in a
+        prefork parent, ONNX-served models are exported and checked in a
+        subprocess but not opened: this process then runs no inference and
+        holds no ONNX Runtime thread pools for its children to inherit, and
+        each child opens its own session.
+        """
+        lang = settings.pysentimiento.LANG
+        tasks = settings.pysentimiento.DEFAULT_MODELS
+        try:
+            self.state = "loading"
+            if fork_safe:
+                with startup_timer.phase("export_onnx"):
+                    tasks = [task for task in tasks if not self._export_onnx(task, lang)]
+            logger.info("Loading default models...")
+            with ThreadPoolExecutor(
+                max_workers=max(1, settings.pysentimiento.LOAD_WORKERS),
+                thread_name_prefix="model-loader",
+            ) as pool:
+                with startup_timer.phase("load_models"):
+                    for future in [pool.submit(self._load_model, task, lang) for task in tasks]:
+                        future.result()
+            for task in tasks:
+                if (task, lang) in self.load_seconds:
+                    startup_timer.record(f"load {task} ({lang})", self.load_seconds[(task, lang)])
+            logger.info("Default models loaded successfully.")
+
+            if settings.pysentimiento.WARMUP if warmup is None else warmup:
+                self.state = "warming_up"
+                with startup_timer.phase("warmup"):
+                    self.warmup()
+        except Exception as e:
+            self.state = "failed"
+            self.startup_error = str(e)
+            raise
+        self.state = "ready"
+
+    def _serves_onnx(self, task: str, lang: str) -> bool:
+        inference = settings.inference
+        return inference.BACKEND == "onnx" and task in inference.ONNX_TASKS and (task, lang) not in self.torch_fallback
+
+    def _export_onnx(self, task: str, lang: str) -> bool:
+        """Export an ONNX-served model in a fresh interpreter, unless already exported.
+
+        Returns whether a checked export is in place. One that fails its parity
+        check marks the model to be served with torch instead.
+        """
+        if not self._serves_onnx(task, lang):
+            return False
+        if not (onnx_dir(task, lang) / "analyzer.json").exists():
+            logger.info("Exporting %s (%s) to ONNX in a subprocess...", task, lang)
+            process = multiprocessing.get_context("spawn").Process(
+                target=_export_onnx_model, args=(task, lang), name=f"onnx-export-{task}-{lang}"
+            )
+            process.start()
+            process.join()
+        if (onnx_dir(task, lang) / "analyzer.json").exists():
+            return True
+        logger.error("No checked ONNX export of %s (%s). Serving it with torch", task, lang)
+        self.torch_fallback.add((task, lang))
+        return False
+
+    def warmup(self):
+        """Run a few predictions through every loaded model so the first requests skip one-off costs."""
+        logger.info("Warming up models...")
+        with self._lock:
+            keys = list(self.models.keys())
+        for task, lang in keys:
+            if task == "targeted_sentiment":
+                # Needs a target per text, which a blind warm-up cannot provide
+                continue
+            self._predict_many(task, lang, WARMUP_TEXTS[:1])
+            self._predict_many(task, lang, WARMUP_TEXTS)
+        logger.info("Models warmed up.")
+
+    def _load_model(self, task: str, lang: str):
+        key = (task, lang)
+        with self._lock:
+            if key in self.models:
+                return self.models[key]
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+        if not owner:
+            logger.info("Model %s (%s) is already loading. Waiting...", task, lang)
+            return future.result()
+
+        logger.info("Loading model: %s (%s)", task, lang)
+        start = time.perf_counter()
+        try:
+            model = self._create_model(task, lang)
+        except Exception as e:
+            logger.error("Failed to load model %s (%s): %s", task, lang, e)
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise e
+        elapsed = time.perf_counter() - start
+        logger.info("Loaded model %s (%s) in %.2fs", task, lang, elapsed)
+        with self._lock:
+            self.models[key] = model
+            self.load_seconds[key] = elapsed
+            self.model_sizes[key] = model_memory_bytes(model)
+            fingerprint = tokenizer_fingerprint(model) if task in SEQUENCE_CLASSIFICATION_TASKS else None
+            if fingerprint is not None:
+                self.tokenizer_fingerprints[key] = fingerprint
+            del self._loading[key]
+            self._evict(keep=key)
+        future.set_result(model)
+        return model
+
+    def _create_model(self, task: str, lang: str):
+        """Build the analyzer for (task, lang) with the configured backend."""
+        inference = settings.inference
+        if inference.OFFLINE:
+            enable_offline_mode()
+        # Deferred so that importing the service does not import the whole ML stack
+        from pysentimiento import create_analyzer
+
+        def load_torch():
+            return create_analyzer(
+                task=task,
+                lang=lang,
+                batch_size=settings.pysentimiento.BATCH_SIZE,
+            )
+
+        def create_torch():
+            if inference.SAFETENSORS_DIR is not None:
+                return load_safetensors_analyzer(task, lang, load_torch)
+            return load_torch()
+
+        if self._serves_onnx(task, lang):
+            from app.services.backends import load_onnx_analyzer
+            return load_onnx_analyzer(task, lang, create_torch, WARMUP_TEXTS)
+
+        model = create_torch()
+        if inference.QUANTIZE:
+            if settings.device != Device.cpu:
+                logger.warning("Dynamic int8 quantization only runs on CPU. Keeping %s (%s) in full precision", task, lang)
+            else:
+                before, after = quantize_dynamic(model)
+                logger.info(
+                    "Quantized %s (%s) to int8: %.1f MB -> %.1f MB",
+                    task, lang, before / 1024 / 1024, after / 1024 / 1024,
+                )
+                self.model_float_sizes[(task, lang)] = before
+        return model
+
+    def get_model(self, task: str, lang: str | None = None):
         """Get a model, loading it if necessary."""
-        if task not in self.models:
-            logger.info("Model %s not loaded. Loading on-call...", task)
-            self._load_model(task)
-        return self.models[task]
+        key = (task, lang or settings.pysentimiento.LANG)
+        with self._lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key]
+        logger.info("Model %s (%s) not loaded. Loading on-call...", *key)
+        return self._load_model(*key)
+
+    def _evict(self, keep: ModelKey):
+        """Unload least recently used models until the registry fits its limits."""
+        limits = settings.pysentimiento
+        budget = limits.MEMORY_BUDGET_MB * 1024 * 1024 if limits.MEMORY_BUDGET_MB is not None else None
+        while len(self.models) > 1:
+            over_count = limits.MAX_MODELS is not None and len(self.models) > limits.MAX_MODELS
+            over_budget = budget is not None and self.memory_usage() > budget
+            if not (over_count or over_budget):
+                return
+            victim = next(key for key in self.models if key != keep)
+            logger.info("Evicting model %s (%s) to stay within registry limits", *victim)
+            self.unload_model(*victim)
+        if budget is not None and self.memory_usage() > budget:
+            logger.warning("Model %s (%s) alone exceeds the memory budget of %s MB", *keep, limits.MEMORY_BUDGET_MB)
+
+    def memory_usage(self) -> int:
+        """Estimated bytes held by all loaded models."""
+        with self._lock:
+            return sum(self.model_sizes.get(key, 0) for key in self.models)
+
+    def model_id(self, task: str, lang: str | None = None) -> str:
+        """Identify the weights serving a task, so cached results never outlive a model swap."""
+        model = self.get_model(task, lang)
+        return (
+            getattr(model, "name_or_path", None)
+            or getattr(getattr(model, "model", None), "name_or_path", None)
+            or task
+        )
+
+    def predict(
+        self,
+        task: str,
+        texts: list[str],
+        lang: str | None = None,
+        encodings: SharedEncodings | None = None,
+        long_text: bool = False,
+        targets: list[str] | None = None,
+    ) -> list[Any]:
+        """
+        Run a task over a list of texts.
+
+        Single texts are merged with other concurrent callers through the task's
+        micro-batcher when batching is enabled for it. Otherwise sequence
+        classifiers reuse `encodings`, the preprocessed and tokenized texts
+        shared by the other tasks of the same request. With `long_text`, texts
+        longer than the model's input are analyzed in overlapping windows.
+        targeted_sentiment takes the `targets` to score, one per text.
+        """
+        lang = lang or settings.pysentimiento.LANG
+        if targets is not None:
+            return self._predict_many(task, lang, texts, targets=targets)
+        if long_text and task in WINDOWED_TASKS:
+            return self._predict_long(task, lang, texts, encodings)
+        if len(texts) == 1:
+            batcher = self._get_batcher(task, lang)
+            if batcher is not None:
+                # Profiled from the caller's side, waiting for the batch included
+                with profiling.stage(f"model:{task}"):
+                    return [batcher.submit(texts[0]).result()]
+        return self._predict_many(task, lang, texts, encodings)
+
+    def _predict_long(
+        self,
+        task: str,
+        lang: str,
+        texts: list[str],
+        encodings: SharedEncodings | None = None,
+    ) -> list[Any]:
+        """Predict texts of any length, one merged result per text.
+
+        Sequence classifiers that take shared encodings run token windows in a
+        single length-sorted pass. Models fed raw text run word windows, merged
+        by averaging probabilities or by keeping each token and entity from the
+        window that owns its position.
+        """
+        self.get_model(task, lang)
+        if (task, lang) in self.tokenizer_fingerprints:
+            return self._predict_many(task, lang, texts, encodings, long_text=True)
+        long_text = settings.long_text
+        windows = [word_windows(text, long_text.WINDOW_WORDS, long_text.STRIDE_WORDS) for text in texts]
+        preds = iter(self._predict_many(
+            task, lang, [text[w.start:w.end] for text, text_windows in zip(texts, windows) for w in text_windows]
+        ))
+        merge = merge_tokens if task in ("ner", "pos") else merge_classifications
+        return [
+            merge(text, text_windows, [next(preds) for _ in text_windows])
+            for text, text_windows in zip(texts, windows)
+        ]
+
+    def _predict_many(
+        self,
+        task: str,
+        lang: str,
+        texts: list[str],
+        encodings: SharedEncodings | None = None,
+        long_text: bool = False,
+        targets: list[str] | None = None,
+    ) -> list[Any]:
+        model = self.get_model(task, lang)
+        fingerprint = self.tokenizer_fingerprints.get((task, lang))
+        metrics.BATCH_SIZE.observe(len(texts), task=task)
+        metrics.INFERENCE_TEXTS.inc(len(texts), task=task, lang=lang)
+        with metrics.INFERENCE_SECONDS.time(task=task, lang=lang):
+            if fingerprint is not None:
+                predict = predict_windowed if long_text else predict_encoded
+                return predict(model, texts, encodings or SharedEncodings(), fingerprint, f"model:{task}")
+            with profiling.stage(f"model:{task}"):
+                if targets is not None:
+                    if len(texts) == 1:
+                        return [model.predict(texts[0], target=targets[0])]
+                    return list(model.predict(texts, target=targets))
+                if len(texts) == 1:
+                    # pysentimiento's single-text path skips the batching machinery
+                    return [model.predict(texts[0])]
+                return list(model.predict(texts))
+
+    def _get_batcher(self, task: str, lang: str) -> MicroBatcher | None:
+        batching = settings.batching
+        if not batching.ENABLED or task not in batching.TASKS:
+            return None
+        key = (task, lang)
+        if key not in self.batchers:
+            self.batchers.setdefault(key, MicroBatcher(
+                f"{task}-{lang}",
+                lambda texts: self._predict_many(task, lang, texts),
+                max_batch_size=batching.max_batch_size(task),
+                max_wait_ms=batching.max_wait_ms(task),
+            ))
+        return self.batchers[key]
+
+    def unload_model(self, task: str, lang: str):
+        """Unload a single model. Requests already using it keep their reference."""
+        with self._lock:
+            self.models.pop((task, lang), None)
+            self.model_sizes.pop((task, lang), None)
+            self.model_float_sizes.pop((task, lang), None)
+            self.tokenizer_fingerprints.pop((task, lang), None)
+            self.load_seconds.pop((task, lang), None)
 
     def unload_models(self):
         """Unload all models and clear memory."""
         logger.info("Unloading models...")
-        self.models.clear()
+        for batcher in self.batchers.values():
+            batcher.stop()
+        self.batchers.clear()
+        with self._lock:
+            self.models.clear()
+            self.model_sizes.clear()
+            self.model_float_sizes.clear()
+            self.tokenizer_fingerprints.clear()
+            self.load_seconds.clear()
+        self.state = "idle"
         import gc
         gc.collect()
         logger.info("Models unloaded successfully.")
 
 analyzer_service = AnalyzerService()
+
+def _model_samples(values: Dict[ModelKey, float]):
+    def samples():
+        with analyzer_service._lock:
+            return [(key, values[key]) for key in analyzer_service.models if key in values]
+    return samples
+
+def _export_onnx_model(task: str, lang: str):
+    """Subprocess target: export (task, lang), keeping the export only if it passes the parity check."""
+    logging.basicConfig(level=settings.LOG_LEVEL, format=settings.LOG_FORMAT)
+    analyzer_service._create_model(task, lang)
+
+metrics.MODEL_LOAD_SECONDS.set_function(_model_samples(analyzer_service.load_seconds))
+metrics.MODEL_MEMORY_BYTES.set_function(_model_samples(analyzer_service.model_sizes))
@@ -0,0 +1,425 @@
+import itertools
+import json
+import logging
+import os
+import shutil
+import struct
+import sys
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# The TorchScript-based exporter keeps global state, so models loading in parallel export one at a time
+_export_lock = threading.Lock()
+
+def model_memory_bytes(analyzer: Any) -> int:
+    """Estimate the memory held by an analyzer's weights and buffers."""
+    if hasattr(analyzer, "memory_bytes"):
+        return analyzer.memory_bytes()
+    module = getattr(analyzer, "model", None)
+    if module is None or not hasattr(module, "parameters"):
+        return 0
+    tensors = list(itertools.chain(module.parameters(), module.buffers()))
+    # Dynamically quantized linear layers keep their weights in packed params
+    for submodule in module.modules():
+        packed = getattr(submodule, "_packed_params", None)
+        if packed is not None and hasattr(packed, "_weight_bias"):
+            tensors.extend(t for t in packed._weight_bias() if t is not None)
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+def quantize_dynamic(analyzer: Any) -> tuple[int, int]:
+    """Quantize an analyzer's linear layers to int8 in place.
+
+    Returns the estimated weight memory before and after quantization.
+    """
+    import torch
+
+    before = model_memory_bytes(analyzer)
+    model = analyzer.model
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    analyzer.model = quantized
+    # pysentimiento's batched predict runs through a Trainer holding its own reference
+    trainer = getattr(analyzer, "eval_trainer", None)
+    if trainer is not None:
+        trainer.model = trainer.model_wrapped = quantized
+    analyzer.name_or_path = f"{getattr(model, 'name_or_path', '')}+int8"
+    return before, model_memory_bytes(analyzer)
+
+@dataclass
+class ClassificationOutput:
+    """Prediction with the same `output`/`probas` attributes as pysentimiento's AnalyzerOutput."""
+
+    sentence: str
+    output: str | list[str]
+    probas: dict[str, float]
+
+    def __repr__(self) -> str:
+        return f"ClassificationOutput(output={self.output!r}, probas={self.probas!r})"
+
+def logits_to_probs(logits: Any, multilabel: bool) -> Any:
+    """Softmax over labels, or a sigmoid per label for multi-label tasks (hate_speech)."""
+    import numpy as np
+
+    logits = np.asarray(logits, dtype=np.float64)
+    if multilabel:
+        return 1 / (1 + np.exp(-logits))
+    shifted = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return shifted / shifted.sum(axis=-1, keepdims=True)
+
+def probs_to_outputs(
+    sentences: list[str],
+    probs: Any,
+    id2label: dict[int, str],
+    multilabel: bool,
+) -> list[ClassificationOutput]:
+    """Turn a (batch, labels) probabilities array into pysentimiento-style outputs.
+
+    Single-label tasks report the most likely label, multi-label tasks every
+    label above 0.5.
+    """
+    labels = [id2label[i] for i in range(probs.shape[-1])]
+    outputs = []
+    for sentence, row in zip(sentences, probs):
+        probas = {label: float(p) for label, p in zip(labels, row)}
+        if multilabel:
+            output = [label for label, p in probas.items() if p > 0.5]
+        else:
+            output = labels[int(row.argmax())]
+        outputs.append(ClassificationOutput(sentence=sentence, output=output, probas=probas))
+    return outputs
+
+def logits_to_outputs(
+    sentences: list[str],
+    logits: Any,
+    id2label: dict[int, str],
+    multilabel: bool,
+) -> list[ClassificationOutput]:
+    """Turn a (batch, labels) logits array into pysentimiento-style outputs."""
+    return probs_to_outputs(sentences, logits_to_probs(logits, multilabel), id2label, multilabel)
+
+class OnnxSequenceClassifier:
+    """ONNX Runtime drop-in for pysentimiento's sequence classification analyzers.
+
+    Exposes the same `predict(str | list[str])` interface and output attributes,
+    so the rest of the service does not need to know which backend is serving a task.
+    """
+
+    def __init__(self, path: Path):
+        from transformers import AutoTokenizer
+
+        meta = json.loads((path / "analyzer.json").read_text(encoding="utf-8"))
+        self.path = path
+        self.name_or_path = f"{meta['source_model']}+onnx"
+        self.id2label = {int(k): v for k, v in meta["id2label"].items()}
+        self.multilabel = meta["multilabel"]
+        self.preprocessing_args = meta["preprocessing_args"]
+        self.max_length = meta["max_length"]
+        self.batch_size = settings.pysentimiento.BATCH_SIZE
+        self.tokenizer = AutoTokenizer.from_pretrained(str(path))
+
+        self._session = None
+        self._session_pid = None
+        self._open_session()
+
+    @property
+    def session(self):
+        """The ONNX Runtime session of the current process.
+
+        Sessions own thread pools that do not survive a fork, so a forked worker
+        opens its own instead of reusing the one created in the parent.
+        """
+        if self._session is None or self._session_pid != os.getpid():
+            self._open_session()
+        return self._session
+
+    def _open_session(self):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if settings.inference.ONNX_THREADS:
+            options.intra_op_num_threads = settings.inference.ONNX_THREADS
+        self._session = onnxruntime.InferenceSession(
+            str(self.path / "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self._session_pid = os.getpid()
+        self.input_names = {i.name for i in self._session.get_inputs()}
+
+    def memory_bytes(self) -> int:
+        return (self.path / "model.onnx").stat().st_size
+
+    def preprocess(self, text: str) -> str:
+        from pysentimiento.preprocessing import preprocess_tweet
+
+        return preprocess_tweet(text, **self.preprocessing_args)
+
+    def logits(self, texts: list[str]) -> Any:
+        """Run already preprocessed texts through the session and return raw logits."""
+        import numpy as np
+
+        chunks = []
+        for start in range(0, len(texts), self.batch_size):
+            encoded = self.tokenizer(
+                texts[start:start + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np",
+            )
+            chunks.append(self.logits_from_features(encoded))
+        return np.concatenate(chunks)
+
+    def logits_from_features(self, encoded: Any) -> Any:
+        """Run one padded batch of tokenizer output through the session."""
+        import numpy as np
+
+        session = self.session
+        feed = {name: np.asarray(value, dtype=np.int64) for name, value in encoded.items() if name in self.input_names}
+        return session.run(["logits"], feed)[0]
+
+    def predict(self, inputs: str | list[str]):
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        sentences = [self.preprocess(text) for text in texts]
+        outputs = logits_to_outputs(sentences, self.logits(sentences), self.id2label, self.multilabel)
+        return outputs[0] if isinstance(inputs, str) else outputs
+
+# safetensors dtype names and their torch dtype attribute
+_SAFETENSORS_DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool",
+}
+
+def enable_offline_mode():
+    """Keep transformers and the Hugging Face Hub client from touching the network."""
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    # Read once at import, so patch it if the hub client is already loaded
+    constants = sys.modules.get("huggingface_hub.constants")
+    if constants is not None:
+        constants.HF_HUB_OFFLINE = True
+
+def convert_safetensors(analyzer: Any, path: Path):
+    """Save an analyzer's model and tokenizer to `path`, with the weights as safetensors."""
+    model = analyzer.model
+    tmp = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    model.save_pretrained(str(tmp), safe_serialization=True)
+    analyzer.tokenizer.save_pretrained(str(tmp))
+    meta = {
+        "source_model": getattr(model, "name_or_path", ""),
+        # pysentimiento only applies a default model's preprocessing when it loads it by task
+        "preprocessing_args": getattr(analyzer, "preprocessing_args", {}) or {},
+    }
+    (tmp / "analyzer.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    # Publish atomically. Another process may have converted the same model meanwhile
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def mmap_safetensors(path: Path) -> dict[str, Any]:
+    """Tensors of a safetensors file backed by a private, read-only-in-practice mapping of the file.
+
+    Nothing is read up front: pages are faulted in from the OS page cache,
+    which every process mapping the same file shares. Tensors whose offset is
+    not aligned to their dtype are copied instead.
+    """
+    import torch
+
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    storage = torch.UntypedStorage.from_file(str(path), shared=False, nbytes=os.path.getsize(path))
+    base = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        dtype = getattr(torch, _SAFETENSORS_DTYPES[info["dtype"]])
+        start, end = info["data_offsets"]
+        raw = torch.empty(0, dtype=torch.uint8).set_(storage, base + start, (end - start,))
+        if (base + start) % dtype.itemsize:
+            raw = raw.clone()
+        tensors[name] = raw.view(dtype).reshape(info["shape"])
+    return tensors
+
+def map_weights(model: Any, path: Path) -> tuple[int, list[str]]:
+    """Replace a model's CPU weights with tensors mapped from a safetensors file.
+
+    Returns the number of bytes now backed by the file, and the names of the
+    weights the file does not hold. Tied weights saved once are tied again, so
+    only truly absent ones are listed; they keep whatever the model held.
+    """
+    tensors = mmap_safetensors(path)
+    result = model.load_state_dict(tensors, strict=False, assign=True)
+    model.tie_weights()
+    mapped = set(tensors) - set(result.unexpected_keys)
+    shared = {tensors[name].data_ptr() for name in mapped}
+    state = model.state_dict()
+    absent = [name for name in result.missing_keys if state[name].data_ptr() not in shared]
+    return sum(tensors[name].numel() * tensors[name].element_size() for name in mapped), absent
+
+def build_mapped_analyzer(task: str, lang: str, path: Path) -> Any:
+    """Build the pysentimiento analyzer of a converted directory without reading its weights.
+
+    The model is instantiated with uninitialized weights, whose pages are never
+    touched and so never resident, then given the tensors mapped from the file.
+    """
+    from pysentimiento.analyzer import AnalyzerForSequenceClassification, AnalyzerForTokenClassification, models
+    from transformers import AutoConfig, AutoModelForSequenceClassification, AutoModelForTokenClassification, AutoTokenizer
+
+    try:
+        from transformers.initialization import no_init_weights
+    except ImportError:  # transformers < 5
+        from transformers.modeling_utils import no_init_weights
+
+    meta = json.loads((path / "analyzer.json").read_text(encoding="utf-8"))
+    preprocessing_args = meta.get("preprocessing_args")
+    if preprocessing_args is None:
+        # Converted before the arguments were recorded
+        preprocessing_args = {**models[lang][task].get("preprocessing_args", {}), "lang": lang}
+    token_classification = task in ("ner", "pos")
+    auto_model = AutoModelForTokenClassification if token_classification else AutoModelForSequenceClassification
+    with no_init_weights():
+        model = auto_model.from_config(AutoConfig.from_pretrained(str(path)))
+    mapped, absent = map_weights(model, path / "model.safetensors")
+    if absent:
+        raise ValueError(f"{path / 'model.safetensors'} has no weights for {', '.join(absent)}")
+    model.eval()
+    tokenizer = AutoTokenizer.from_pretrained(str(path))
+    batch_size = settings.pysentimiento.BATCH_SIZE
+    if token_classification:
+        analyzer = AnalyzerForTokenClassification(
+            model, tokenizer, task, lang, chunk=task == "ner", preprocessing_args=preprocessing_args, batch_size=batch_size
+        )
+    else:
+        analyzer = AnalyzerForSequenceClassification(model, tokenizer, task, preprocessing_args, batch_size)
+    logger.info("Memory-mapped %.1f MB of weights for %s (%s)", mapped / 1024 / 1024, task, lang)
+    return analyzer
+
+def load_safetensors_analyzer(task: str, lang: str, create_torch: Callable[[], Any]) -> Any:
+    """Load a torch analyzer for (task, lang) with its weights memory-mapped from INFERENCE__SAFETENSORS_DIR.
+
+    The first load converts the model pysentimiento downloads (or finds in the
+    hub cache) to `<task>-<lang>/` and maps its weights in place of the loaded
+    ones. Later loads build the analyzer from that directory without reading
+    the weights, and never touch the network. `create_torch` loads
+    pysentimiento's default model for the task.
+    """
+    path = Path(settings.inference.SAFETENSORS_DIR) / f"{task}-{lang}"
+    if (path / "analyzer.json").exists():
+        logger.info("Loading %s (%s) from %s", task, lang, path)
+        analyzer = build_mapped_analyzer(task, lang, path)
+    else:
+        analyzer = create_torch()
+        logger.info("Converting %s (%s) to safetensors at %s", task, lang, path)
+        convert_safetensors(analyzer, path)
+        if any(p.device.type != "cpu" for p in analyzer.model.parameters()):
+            logger.info("Weights of %s (%s) are not on the CPU. Skipping memory mapping", task, lang)
+        else:
+            mapped, _ = map_weights(analyzer.model, path / "model.safetensors")
+            logger.info("Memory-mapped %.1f MB of weights for %s (%s)", mapped / 1024 / 1024, task, lang)
+    # Identify the model by its source, so cached predictions carry over
+    source = json.loads((path / "analyzer.json").read_text(encoding="utf-8"))["source_model"]
+    if source:
+        analyzer.model.name_or_path = source
+        analyzer.model.config._name_or_path = source
+    return analyzer
+
+def export_onnx(analyzer: Any, path: Path):
+    """Export a pysentimiento sequence classification analyzer to `path`."""
+    import torch
+
+    model = analyzer.model.eval()
+    tokenizer = analyzer.tokenizer
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+    tmp = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    sample = tokenizer(["warm-up", "a slightly longer warm-up text"], padding=True, return_tensors="pt")
+    with _export_lock, torch.no_grad():
+        # The exporter restores the wrapper's training mode afterwards, recursively,
+        # so the wrapper itself must be in eval mode or dropout is left switched on
+        torch.onnx.export(
+            LogitsOnly().eval(),
+            (sample["input_ids"], sample["attention_mask"]),
+            str(tmp / "model.onnx"),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=17,
+            dynamo=False,
+        )
+    tokenizer.save_pretrained(str(tmp))
+    meta = {
+        "source_model": getattr(model, "name_or_path", ""),
+        "id2label": {str(k): v for k, v in model.config.id2label.items()},
+        "multilabel": model.config.problem_type == "multi_label_classification",
+        "preprocessing_args": getattr(analyzer, "preprocessing_args", {}) or {},
+        "max_length": tokenizer.model_max_length,
+    }
+    (tmp / "analyzer.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    # Publish atomically so a crashed export is never picked up as a finished one
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+
+def check_parity(torch_analyzer: Any, onnx_analyzer: OnnxSequenceClassifier, texts: list[str]) -> dict:
+    """Compare ONNX predictions against the torch analyzer on the same texts."""
+    expected = torch_analyzer.predict(texts)
+    actual = onnx_analyzer.predict(texts)
+    max_abs_diff = 0.0
+    agree = 0
+    for exp, act in zip(expected, actual):
+        for label, p in exp.probas.items():
+            max_abs_diff = max(max_abs_diff, abs(p - act.probas.get(label, 0.0)))
+        agree += exp.output == act.output
+    return {
+        "texts": len(texts),
+        "max_abs_diff": max_abs_diff,
+        "label_agreement": agree / len(texts) if texts else 1.0,
+    }
+
+def onnx_dir(task: str, lang: str) -> Path:
+    """Directory of the ONNX export of (task, lang)."""
+    return Path(settings.inference.ONNX_DIR) / f"{task}-{lang}"
+
+def load_onnx_analyzer(task: str, lang: str, create_torch: Callable[[], Any], parity_texts: list[str]) -> Any:
+    """Load a previously exported ONNX analyzer for (task, lang), exporting it first if needed.
+
+    A fresh export is checked against the torch model on `parity_texts`. If it
+    drifts beyond `INFERENCE__ONNX_PARITY_TOLERANCE`, the torch analyzer is
+    returned instead so a bad export never serves traffic.
+    """
+    path = onnx_dir(task, lang)
+    if (path / "analyzer.json").exists():
+        logger.info("Loading exported ONNX model for %s (%s) from %s", task, lang, path)
+        return OnnxSequenceClassifier(path)
+
+    torch_analyzer = create_torch()
+    logger.info("Exporting %s (%s) to ONNX at %s", task, lang, path)
+    export_onnx(torch_analyzer, path)
+    onnx_analyzer = OnnxSequenceClassifier(path)
+
+    parity = check_parity(torch_analyzer, onnx_analyzer, parity_texts)
+    logger.info("ONNX parity for %s (%s): %s", task, lang, parity)
+    if parity["max_abs_diff"] > settings.inference.ONNX_PARITY_TOLERANCE:
+        logger.error("ONNX export of %s (%s) failed the parity check. Serving it with torch", task, lang)
+        shutil.rmtree(path, ignore_errors=True)
+        return torch_analyzer
+    return onnx_analyzer
@@ -0,0 +1,108 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class MicroBatcher:
+    """Merges concurrent single-text predictions into batched model calls.
+
+    Callers submit one text and get a future back. A background thread
+    collects pending texts until either `max_batch_size` items are queued or
+    `max_wait_ms` has passed since the first one arrived, runs them through
+    `predict_batch` in one call and resolves every future with its own slice.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        predict_batch: Callable[[list[str]], list[Any]],
+        max_batch_size: int,
+        max_wait_ms: float,
+    ):
+        self.name = name
+        self.predict_batch = predict_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, text: str) -> Future:
+        """Queue a text for the next batch and return a future for its prediction."""
+        future: Future = Future()
+        self._ensure_started()
+        self._queue.put((text, future))
+        return future
+
+    def stop(self):
+        """Stop the dispatch thread, failing any prediction still queued."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join()
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                item[1].set_exception(RuntimeError(f"Batcher {self.name} stopped"))
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"batcher-{self.name}", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._dispatch(batch)
+            if stopping:
+                return
+
+    def _dispatch(self, batch: list[tuple[str, Future]]):
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        # Identical texts in the same window share a single prediction
+        positions: dict[str, int] = {}
+        for text, _ in batch:
+            positions.setdefault(text, len(positions))
+
+        logger.debug("Batcher %s dispatching %d request(s), %d unique text(s)", self.name, len(batch), len(positions))
+        try:
+            preds = self.predict_batch(list(positions))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for text, future in batch:
+            future.set_result(preds[positions[text]])
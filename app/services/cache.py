@@ -0,0 +1,305 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Hashable
+
+from app.core import metrics
+from app.core.config import settings
+from app.helpers.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different copies of a text share an entry."""
+    return " ".join(text.split())
+
+class PredictionCache:
+    """Thread-safe LRU cache of per-task prediction results with optional TTL."""
+
+    def __init__(self, enabled: bool, max_size: int, ttl_seconds: float | None = None):
+        self.enabled = enabled and max_size > 0
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text: str, task: str, lang: str, model_id: str) -> tuple:
+        return (normalize_text(text), task, lang, model_id)
+
+    def get(self, key: Hashable) -> Any | None:
+        """Return the cached value for a key, or None on a miss."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else 0.0
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+_DISK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    key BLOB PRIMARY KEY,
+    value BLOB NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS predictions_accessed ON predictions (accessed);
+"""
+
+# Keys per IN (...) lookup, below SQLite's default limit of bound variables
+_LOOKUP_CHUNK = 500
+# Hits refresh their access time at most this often, so lookups rarely write
+_TOUCH_SECONDS = 3600
+# Entries written by a process between two size checks
+_COMPACT_EVERY = 1000
+# Compaction deletes down to this fraction of the limit, so it does not run again right away
+_COMPACT_TARGET = 0.9
+
+class DiskCache:
+    """Prediction results in a SQLite file shared by worker processes and kept across restarts.
+
+    Entries are keyed by a digest of the in-memory cache key and hold the
+    result as JSON. Lookups and writes go through in bulk, one query per chunk
+    of texts. Each thread keeps its own connection, opened again in forked
+    workers. SQLite errors (a locked or full disk) are logged and count as
+    misses, so the cache never fails a request.
+    """
+
+    def __init__(self, enabled: bool, path: str, max_mb: float, ttl_seconds: float | None = None):
+        self.enabled = enabled
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    @staticmethod
+    def digest(key: tuple) -> bytes:
+        return hashlib.blake2b("\x1f".join(key).encode("utf-8"), digest_size=16).digest()
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            # A connection inherited through fork must not be used, or closed, by the child
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(_DISK_SCHEMA)
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def _failed(self, operation: str, error: sqlite3.Error):
+        with self._lock:
+            self.errors += 1
+        logger.warning("Disk cache %s failed: %s", operation, error)
+
+    def get_many(self, keys: list[tuple]) -> list[Any | None]:
+        """Return the stored value of each key, or None on a miss."""
+        if not self.enabled or not keys:
+            return [None] * len(keys)
+        digests = [self.digest(key) for key in keys]
+        found: dict[bytes, tuple[bytes, float, float]] = {}
+        try:
+            db = self._connection()
+            for start in range(0, len(digests), _LOOKUP_CHUNK):
+                chunk = digests[start:start + _LOOKUP_CHUNK]
+                rows = db.execute(
+                    f"SELECT key, value, created, accessed FROM predictions WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                found.update((row[0], row[1:]) for row in rows)
+        except sqlite3.Error as e:
+            self._failed("lookup", e)
+            return [None] * len(keys)
+
+        now = time.time()
+        results: list[Any | None] = []
+        touched = []
+        for digest in digests:
+            entry = found.get(digest)
+            if entry is not None and self.ttl_seconds is not None and entry[1] < now - self.ttl_seconds:
+                entry = None
+            if entry is None:
+                results.append(None)
+                continue
+            results.append(json.loads(entry[0]))
+            if entry[2] < now - _TOUCH_SECONDS:
+                touched.append((now, digest))
+        hits = len(results) - results.count(None)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(results) - hits
+        if touched:
+            try:
+                with db:
+                    db.executemany("UPDATE predictions SET accessed = ? WHERE key = ?", touched)
+            except sqlite3.Error as e:
+                self._failed("access update", e)
+        return results
+
+    def put_many(self, items: list[tuple[tuple, Any]]):
+        """Store (key, value) pairs in one transaction, compacting the file now and then."""
+        if not self.enabled or not items:
+            return
+        now = time.time()
+        rows = [(self.digest(key), dumps(value), now, now) for key, value in items]
+        try:
+            db = self._connection()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO predictions (key, value, created, accessed) VALUES (?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            self._failed("write", e)
+            return
+        with self._lock:
+            self._writes += len(rows)
+            due = self._writes >= _COMPACT_EVERY
+            if due:
+                self._writes = 0
+        if due:
+            self.compact()
+
+    @staticmethod
+    def _live_bytes(db: sqlite3.Connection) -> int:
+        """Bytes of the database pages in use, i.e. excluding pages freed for reuse."""
+        page_size = db.execute("PRAGMA page_size").fetchone()[0]
+        page_count = db.execute("PRAGMA page_count").fetchone()[0]
+        free = db.execute("PRAGMA freelist_count").fetchone()[0]
+        return page_size * (page_count - free)
+
+    def compact(self) -> int:
+        """Delete the least recently used entries once the live data exceeds DISK_MAX_MB.
+
+        Freed pages are reused by later writes, so the file stops growing
+        without being rewritten. Returns the number of entries deleted.
+        """
+        if not self.enabled:
+            return 0
+        try:
+            db = self._connection()
+            with db:
+                # Hold the write lock while measuring, so concurrent workers compact one after another
+                db.execute("BEGIN IMMEDIATE")
+                live = self._live_bytes(db)
+                if live <= self.max_bytes:
+                    return 0
+                count = db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+                excess = math.ceil(count * (1 - _COMPACT_TARGET * self.max_bytes / live))
+                deleted = db.execute(
+                    "DELETE FROM predictions WHERE key IN (SELECT key FROM predictions ORDER BY accessed LIMIT ?)",
+                    (excess,),
+                ).rowcount
+        except sqlite3.Error as e:
+            self._failed("compaction", e)
+            return 0
+        with self._lock:
+            self.evictions += deleted
+        logger.info("Compacted the disk cache: deleted %d of %d entries (%.1f MB live)", deleted, count, live / 1024 / 1024)
+        return deleted
+
+    def size_bytes(self) -> int:
+        if not self.enabled or not Path(self.path).exists():
+            return 0
+        try:
+            return self._live_bytes(self._connection())
+        except sqlite3.Error as e:
+            self._failed("size check", e)
+            return 0
+
+    def stats(self) -> dict:
+        size = self.size_bytes()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "path": self.path,
+                "size_mb": round(size / 1024 / 1024, 1),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "errors": self.errors,
+            }
+
+prediction_cache = PredictionCache(
+    enabled=settings.cache.ENABLED,
+    max_size=settings.cache.MAX_SIZE,
+    ttl_seconds=settings.cache.TTL_SECONDS,
+)
+
+disk_cache = DiskCache(
+    enabled=settings.cache.DISK_ENABLED,
+    path=settings.cache.DISK_PATH,
+    max_mb=settings.cache.DISK_MAX_MB,
+    ttl_seconds=settings.cache.TTL_SECONDS,
+)
+
+def _cache_samples(collect):
+    """Scrape-time samples from the cache statistics, none while the cache is disabled."""
+    def samples():
+        return collect(prediction_cache.stats()) if prediction_cache.enabled else []
+    return samples
+
+metrics.CACHE_REQUESTS.set_function(_cache_samples(lambda stats: [(("hit",), stats["hits"]), (("miss",), stats["misses"])]))
+metrics.CACHE_EVICTIONS.set_function(_cache_samples(lambda stats: [((), stats["evictions"])]))
+metrics.CACHE_SIZE.set_function(_cache_samples(lambda stats: [((), stats["size"])]))
+
+def _disk_cache_samples(collect):
+    def samples():
+        return collect(disk_cache.stats()) if disk_cache.enabled else []
+    return samples
+
+metrics.DISK_CACHE_REQUESTS.set_function(_disk_cache_samples(lambda stats: [(("hit",), stats["hits"]), (("miss",), stats["misses"])]))
+metrics.DISK_CACHE_EVICTIONS.set_function(_disk_cache_samples(lambda stats: [((), stats["evictions"])]))
+metrics.DISK_CACHE_BYTES.set_function(lambda: [((), disk_cache.size_bytes())] if disk_cache.enabled else [])
@@ -0,0 +1,217 @@
+"""
+Cascaded screening for the hate_speech and irony tasks.
+
+A hashed bag-of-words logistic regression, trained on the full model's own
+decisions with `python -m app.cli train-cascade`, scores every text first.
+Texts it is confident about (score below LOW or above HIGH) are answered
+without the transformer. The rest, plus an AUDIT_RATE sample of the screened
+ones, are escalated to the full model.
+"""
+import json
+import logging
+import random
+import re
+import threading
+import zlib
+from pathlib import Path
+from typing import Any
+
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Hashed feature space of the scorer
+N_FEATURES = 2 ** 18
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+def _hashed_features(text: str) -> dict[int, float]:
+    """L2-normalized counts of the lowercased words and word bigrams of a text."""
+    words = _TOKEN.findall(text.lower())
+    counts: dict[int, float] = {}
+    for gram in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        index = zlib.crc32(gram.encode("utf-8")) % N_FEATURES
+        counts[index] = counts.get(index, 0.0) + 1.0
+    norm = sum(v * v for v in counts.values()) ** 0.5 or 1.0
+    return {index: value / norm for index, value in counts.items()}
+
+def _design(texts: list[str]) -> tuple[Any, Any, Any]:
+    """Sparse design matrix of texts as (row, column, value) arrays."""
+    import numpy as np
+
+    rows, columns, values = [], [], []
+    for row, text in enumerate(texts):
+        for column, value in _hashed_features(text).items():
+            rows.append(row)
+            columns.append(column)
+            values.append(value)
+    return np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64), np.array(values)
+
+# The label a text gets when it is not hateful/ironic. hate_speech is multi-label: no labels
+NEGATIVE_LABELS: dict[str, Any] = {"hate_speech": [], "irony": "not ironic"}
+
+def negative_label(task: str, analyzer: Any) -> Any:
+    """The negative label of a task, as the model reports it."""
+    model = getattr(analyzer, "model", None)
+    config = getattr(model, "config", None)
+    id2label = getattr(analyzer, "id2label", None) or getattr(config, "id2label", None)
+    multilabel = getattr(analyzer, "multilabel", None)
+    if multilabel is None and config is not None:
+        multilabel = config.problem_type == "multi_label_classification"
+    if multilabel:
+        return []
+    expected = NEGATIVE_LABELS.get(task)
+    if not id2label or expected in id2label.values():
+        if expected is None:
+            raise ValueError(f"No negative label known for {task}")
+        return expected
+    # Label names vary between model versions ("not ironic", "not_ironic", "NOT")
+    for label in id2label.values():
+        if str(label).lower().replace("_", " ").split(" ")[0] in ("not", "non", "no"):
+            return label
+    raise ValueError(f"Cannot tell the negative label of {task} among {sorted(map(str, id2label.values()))}")
+
+def is_positive(result: dict, negative_label: Any) -> bool:
+    """Whether a formatted hate_speech/irony result is anything but the negative label."""
+    return result.get("label") != negative_label
+
+class LinearScorer:
+    """Logistic regression over hashed word and bigram counts."""
+
+    def __init__(self, weights: Any, bias: float, meta: dict):
+        self.weights = weights
+        self.bias = bias
+        self.meta = meta
+
+    @property
+    def negative_label(self) -> Any:
+        return self.meta["negative_label"]
+
+    @property
+    def positive_label(self) -> Any:
+        return self.meta["positive_label"]
+
+    def score(self, texts: list[str]) -> Any:
+        """Probability of each text being positive according to the scorer."""
+        import numpy as np
+
+        rows, columns, values = _design(texts)
+        logits = np.bincount(rows, weights=self.weights[columns] * values, minlength=len(texts)) + self.bias
+        return 1 / (1 + np.exp(-logits))
+
+    @classmethod
+    def train(
+        cls,
+        texts: list[str],
+        positives: list[bool],
+        meta: dict,
+        epochs: int = 300,
+        learning_rate: float = 0.5,
+        l2: float = 1e-5,
+    ) -> "LinearScorer":
+        """Fit the scorer to the full model's decisions with full-batch AdaGrad."""
+        import numpy as np
+
+        rows, columns, values = _design(texts)
+        y = np.asarray(positives, dtype=np.float64)
+        weights = np.zeros(N_FEATURES)
+        bias = 0.0
+        squared = np.full(N_FEATURES, 1e-8)
+        squared_bias = 1e-8
+        for _ in range(epochs):
+            logits = np.bincount(rows, weights=weights[columns] * values, minlength=len(texts)) + bias
+            error = 1 / (1 + np.exp(-logits)) - y
+            grad = np.bincount(columns, weights=error[rows] * values, minlength=N_FEATURES) / len(texts) + l2 * weights
+            grad_bias = error.mean()
+            squared += grad * grad
+            squared_bias += grad_bias * grad_bias
+            weights -= learning_rate * grad / np.sqrt(squared)
+            bias -= learning_rate * grad_bias / squared_bias ** 0.5
+        return cls(weights, float(bias), meta)
+
+    def save(self, path: Path):
+        import numpy as np
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez_compressed(f, weights=self.weights.astype(np.float32), bias=self.bias, meta=json.dumps(self.meta))
+
+    @classmethod
+    def load(cls, path: Path) -> "LinearScorer":
+        import numpy as np
+
+        with np.load(path) as data:
+            return cls(data["weights"].astype(np.float64), float(data["bias"]), json.loads(str(data["meta"])))
+
+def scorer_path(task: str, lang: str) -> Path:
+    return Path(settings.cascade.DIR) / f"{task}-{lang}.npz"
+
+def decision(task: str, score: float) -> bool | None:
+    """The screening decision for a score: positive, negative, or None to escalate."""
+    low, high = settings.cascade.low(task), settings.cascade.high(task)
+    if low is not None and score < low:
+        return False
+    if high is not None and score > high:
+        return True
+    return None
+
+class Cascade:
+    """Trained scorers per (task, lang), loaded on first use."""
+
+    def __init__(self):
+        self._scorers: dict[tuple[str, str], LinearScorer | None] = {}
+        self._lock = threading.Lock()
+
+    def scorer(self, task: str, lang: str) -> LinearScorer | None:
+        key = (task, lang)
+        if key not in self._scorers:
+            with self._lock:
+                if key not in self._scorers:
+                    path = scorer_path(task, lang)
+                    if path.exists():
+                        self._scorers[key] = LinearScorer.load(path)
+                        logger.info("Loaded cascade scorer for %s (%s) from %s", task, lang, path)
+                    else:
+                        self._scorers[key] = None
+                        logger.warning("No cascade scorer for %s (%s) at %s. Running the full model only.", task, lang, path)
+        return self._scorers[key]
+
+    def active(self, task: str, lang: str) -> bool:
+        cascade = settings.cascade
+        return cascade.ENABLED and task in cascade.TASKS and self.scorer(task, lang) is not None
+
+    def screen(self, task: str, lang: str, texts: list[str]) -> tuple[list[dict | None], list[float]]:
+        """Answer the texts the scorer is confident about.
+
+        Returns one result per text, None for the texts to escalate to the full
+        model, and the scores of every text.
+        """
+        scorer = self.scorer(task, lang)
+        scores = [float(p) for p in scorer.score(texts)]
+        results: list[dict | None] = []
+        for score in scores:
+            positive = decision(task, score)
+            if positive is None:
+                metrics.CASCADE_TEXTS.inc(task=task, stage="escalated")
+                results.append(None)
+            elif random.random() < settings.cascade.AUDIT_RATE:
+                metrics.CASCADE_TEXTS.inc(task=task, stage="audited")
+                results.append(None)
+            else:
+                metrics.CASCADE_TEXTS.inc(task=task, stage="screened")
+                label = scorer.positive_label if positive else scorer.negative_label
+                results.append({"label": label, "probas": None, "screened": True, "score": round(score, 4)})
+        return results, scores
+
+    def observe(self, task: str, lang: str, scores: list[float], results: list[dict]):
+        """Record whether the screening decision on each audited text matched the full model."""
+        scorer = self.scorer(task, lang)
+        for score, result in zip(scores, results):
+            positive = decision(task, score)
+            if positive is None:
+                continue
+            agree = positive == is_positive(result, scorer.negative_label)
+            metrics.CASCADE_AGREEMENT.inc(task=task, result="agree" if agree else "disagree")
+
+cascade = Cascade()
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import threading
+from typing import Any
+
+from app.core import profiling
+from app.core.config import settings
+from app.services.backends import ClassificationOutput, logits_to_outputs, logits_to_probs, probs_to_outputs
+
+# Tasks whose models can be fed shared encodings instead of raw text
+SEQUENCE_CLASSIFICATION_TASKS = ("sentiment", "emotion", "hate_speech", "irony")
+
+def tokenizer_fingerprint(analyzer: Any) -> str | None:
+    """Identify an analyzer's tokenizer by its behaviour rather than its name.
+
+    Every model repository ships its own copy of the tokenizer, so two models
+    built on the same base model get equal fingerprints even though their
+    tokenizers were loaded from different paths. Returns None for analyzers
+    that cannot take pre-tokenized input.
+    """
+    tokenizer = getattr(analyzer, "tokenizer", None)
+    model = getattr(analyzer, "model", None)
+    if tokenizer is None or not (hasattr(analyzer, "logits_from_features") or hasattr(model, "config")):
+        return None
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    # A fast tokenizer serializes its whole pipeline: normalizer, pre-tokenizer, vocab and post-processor
+    spec = backend.to_str() if backend is not None else json.dumps(sorted(tokenizer.get_vocab().items()))
+    digest = hashlib.sha256()
+    for part in (type(tokenizer).__name__, str(tokenizer.model_max_length), spec):
+        digest.update(part.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+class SharedEncodings:
+    """Preprocessed and tokenized texts of one request, shared by all of its models.
+
+    Texts are preprocessed once per set of preprocessing arguments and tokenized
+    once per tokenizer fingerprint, however many tasks ask for them. Safe to use
+    from the concurrent task threads of a request.
+    """
+
+    def __init__(self):
+        self._sentences: dict[tuple[str, str], str] = {}
+        self._features: dict[tuple[str, str], dict[str, list[int]]] = {}
+        self._windows: dict[tuple[tuple, str], list[dict[str, list[int]]]] = {}
+        self._lock = threading.Lock()
+        self.tokenized = 0
+        self.reused = 0
+
+    def sentences(self, texts: list[str], preprocessing_args: dict) -> list[str]:
+        """Texts as the model sees them, with tweet preprocessing when PREPROCESS_TWEETS is on."""
+        if not settings.pysentimiento.PREPROCESS_TWEETS:
+            return list(texts)
+        from pysentimiento.preprocessing import preprocess_tweet
+
+        key = json.dumps(preprocessing_args, sort_keys=True)
+        with profiling.stage("preprocessing"), self._lock:
+            for text in texts:
+                if (key, text) not in self._sentences:
+                    self._sentences[(key, text)] = preprocess_tweet(text, **preprocessing_args)
+            return [self._sentences[(key, text)] for text in texts]
+
+    def features(self, sentences: list[str], tokenizer: Any, fingerprint: str) -> list[dict[str, list[int]]]:
+        """Unpadded tokenizer output per sentence, tokenizing only the ones not seen yet."""
+        with profiling.stage("preprocessing"), self._lock:
+            missing = [s for s in dict.fromkeys(sentences) if (fingerprint, s) not in self._features]
+            if missing:
+                encoded = tokenizer(missing, truncation=True)
+                for j, sentence in enumerate(missing):
+                    self._features[(fingerprint, sentence)] = {name: values[j] for name, values in encoded.items()}
+            self.tokenized += len(missing)
+            self.reused += len(sentences) - len(missing)
+            return [self._features[(fingerprint, s)] for s in sentences]
+
+    def windows(
+        self,
+        sentences: list[str],
+        tokenizer: Any,
+        fingerprint: str,
+        max_length: int,
+        stride: int,
+    ) -> list[list[dict[str, list[int]]]]:
+        """Overlapping windows of at most `max_length` tokens per sentence.
+
+        Consecutive windows share `stride` tokens. A sentence that fits in one
+        window gets exactly the features `features` would give it.
+        """
+        key = (fingerprint, max_length, stride)
+        with profiling.stage("preprocessing"), self._lock:
+            missing = [s for s in dict.fromkeys(sentences) if (key, s) not in self._windows]
+            if missing:
+                encoded = tokenizer(
+                    missing,
+                    truncation=True,
+                    max_length=max_length,
+                    stride=stride,
+                    return_overflowing_tokens=True,
+                )
+                names = [name for name in tokenizer.model_input_names if name in encoded]
+                for sentence in missing:
+                    self._windows[(key, sentence)] = []
+                for j, sample in enumerate(encoded["overflow_to_sample_mapping"]):
+                    self._windows[(key, missing[sample])].append({name: encoded[name][j] for name in names})
+            self.tokenized += len(missing)
+            self.reused += len(sentences) - len(missing)
+            return [self._windows[(key, s)] for s in sentences]
+
+def _labels(analyzer: Any) -> tuple[dict[int, str], bool]:
+    """Label names and whether the task is multi-label, for either backend."""
+    if hasattr(analyzer, "logits_from_features"):
+        return analyzer.id2label, analyzer.multilabel
+    config = analyzer.model.config
+    return config.id2label, config.problem_type == "multi_label_classification"
+
+def max_sequence_length(analyzer: Any) -> int:
+    """Longest input the model accepts, in tokens."""
+    length = getattr(analyzer, "max_length", None) or analyzer.tokenizer.model_max_length
+    # Tokenizers without a configured limit report a huge sentinel value
+    return length if length < 100_000 else 512
+
+def sequence_logits(analyzer: Any, features: list[dict[str, list[int]]]) -> Any:
+    """Run pre-tokenized inputs through a sequence classifier and return (batch, labels) logits.
+
+    Inputs are sorted by length before being split into BATCH_SIZE batches, so
+    each batch is padded only to its own longest text.
+    """
+    import numpy as np
+
+    batch_size = max(1, getattr(analyzer, "batch_size", None) or settings.pysentimiento.BATCH_SIZE)
+    order = sorted(range(len(features)), key=lambda j: len(features[j]["input_ids"]))
+    chunks = []
+    for start in range(0, len(order), batch_size):
+        batch = [features[j] for j in order[start:start + batch_size]]
+        if hasattr(analyzer, "logits_from_features"):
+            chunks.append(analyzer.logits_from_features(analyzer.tokenizer.pad(batch, return_tensors="np")))
+            continue
+        import torch
+
+        padded = analyzer.tokenizer.pad(batch, return_tensors="pt").to(analyzer.model.device)
+        with torch.inference_mode():
+            chunks.append(analyzer.model(**padded).logits.float().cpu().numpy())
+    logits = np.concatenate(chunks)
+    # Back to input order
+    restored = np.empty_like(logits)
+    restored[order] = logits
+    return restored
+
+def predict_encoded(
+    analyzer: Any,
+    texts: list[str],
+    encodings: SharedEncodings,
+    fingerprint: str,
+    stage: str = "model",
+) -> list[ClassificationOutput]:
+    """Predict with a sequence classifier through a request's shared encodings.
+
+    The forward pass is profiled as `stage`.
+    """
+    id2label, multilabel = _labels(analyzer)
+    sentences = encodings.sentences(texts, getattr(analyzer, "preprocessing_args", None) or {})
+    features = encodings.features(sentences, analyzer.tokenizer, fingerprint)
+    with profiling.stage(stage):
+        logits = sequence_logits(analyzer, features)
+    return logits_to_outputs(sentences, logits, id2label, multilabel)
+
+def predict_windowed(
+    analyzer: Any,
+    texts: list[str],
+    encodings: SharedEncodings,
+    fingerprint: str,
+    stage: str = "model",
+) -> list[ClassificationOutput]:
+    """Predict texts of any length with a sequence classifier, one result per text.
+
+    Each text is split into overlapping token windows (see LongTextSettings).
+    The windows of every text run together, sorted by length, and their
+    probabilities are averaged per text, weighted by window length.
+    """
+    import numpy as np
+
+    long_text = settings.long_text
+    id2label, multilabel = _labels(analyzer)
+    max_length = min(long_text.WINDOW_TOKENS or max_sequence_length(analyzer), max_sequence_length(analyzer))
+    # The tokenizer rejects a stride that leaves no room for new tokens in each window
+    stride = min(long_text.STRIDE_TOKENS, max_length // 2)
+    sentences = encodings.sentences(texts, getattr(analyzer, "preprocessing_args", None) or {})
+    windows = encodings.windows(sentences, analyzer.tokenizer, fingerprint, max_length, stride)
+    with profiling.stage(stage):
+        logits = sequence_logits(analyzer, [window for text_windows in windows for window in text_windows])
+    probs = logits_to_probs(logits, multilabel)
+
+    documents = []
+    start = 0
+    for text_windows in windows:
+        weights = [len(window["input_ids"]) for window in text_windows]
+        documents.append(np.average(probs[start:start + len(text_windows)], axis=0, weights=weights))
+        start += len(text_windows)
+    return probs_to_outputs(sentences, np.stack(documents), id2label, multilabel)
@@ -0,0 +1,368 @@
+"""
+Asynchronous analysis jobs persisted in SQLite.
+
+A job is a list of texts and one ConfigInput. Its texts and, as they are
+analyzed, their results are stored row by row, so a job survives restarts and
+its results can be read page by page while it runs. Runners claim a job with a
+lease they keep renewing, also while a batch waits for the model; a job whose
+lease lapses (its process died) is picked up again and resumes from its first
+unanalyzed text. Only the lease owner may store results, and a text is stored
+once, so a runner that lost its lease cannot count a batch twice. Every serving process runs
+one runner, and the database arbitrates between them.
+"""
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+from app.core import metrics
+from app.core.config import settings
+from app.helpers.serialization import dumps, response_dict
+from app.models.schemas import ConfigInput
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ("completed", "failed", "cancelled")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    config TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    processed INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    error TEXT,
+    lease_owner TEXT,
+    lease_expires REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    text TEXT,
+    -- JSON line of the result, or of the error, once the text is analyzed
+    output TEXT,
+    failed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (job_id, idx)
+) WITHOUT ROWID;
+"""
+
+class JobStore:
+    """Jobs and their items in a SQLite database, safe to share between threads and processes.
+
+    Each operation opens its own short-lived connection, so nothing is shared
+    across threads or inherited by forked workers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                    with closing(sqlite3.connect(self.path, timeout=30)) as db:
+                        # WAL lets readers page through results while a runner writes
+                        db.execute("PRAGMA journal_mode=WAL")
+                        db.executescript(_SCHEMA)
+                    self._initialized = True
+        with closing(sqlite3.connect(self.path, timeout=30)) as db:
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA synchronous=NORMAL")
+            with db:
+                yield db
+
+    def create(self, config: ConfigInput, items: list[tuple[str | None, str | None]] = (), status: str = "queued") -> str:
+        """Create a job with its first (text, error) items and return its id."""
+        job_id = uuid.uuid4().hex
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, config, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, status, config.model_dump_json(), time.time()),
+            )
+            self._insert_items(db, job_id, 0, list(items))
+        return job_id
+
+    def add_items(self, job_id: str, start: int, items: list[tuple[str | None, str | None]]):
+        """Append (text, error) items from index `start`."""
+        with self._connect() as db:
+            self._insert_items(db, job_id, start, items)
+
+    @staticmethod
+    def _insert_items(db: sqlite3.Connection, job_id: str, start: int, items: list[tuple[str | None, str | None]]):
+        # Items with an error are stored as already processed and failed
+        if not items:
+            return
+        rows = []
+        failed = 0
+        for offset, (text, error) in enumerate(items):
+            if error is not None:
+                failed += 1
+                rows.append((job_id, start + offset, None, dumps({"index": start + offset, "error": error}).decode("utf-8"), 1))
+            else:
+                rows.append((job_id, start + offset, text, None, 0))
+        db.executemany("INSERT INTO items (job_id, idx, text, output, failed) VALUES (?, ?, ?, ?, ?)", rows)
+        db.execute(
+            "UPDATE jobs SET total = total + ?, processed = processed + ?, errors = errors + ? WHERE id = ?",
+            (len(rows), failed, failed, job_id),
+        )
+
+    def set_status(self, job_id: str, status: str, error: str | None = None) -> bool:
+        """Move a job to `status`. Finished jobs never change again."""
+        finished_at = time.time() if status in FINISHED else None
+        with self._connect() as db:
+            cursor = db.execute(
+                f"UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_owner = NULL, lease_expires = NULL "
+                f"WHERE id = ? AND status NOT IN ({','.join('?' * len(FINISHED))})",
+                (status, error, finished_at, job_id, *FINISHED),
+            )
+            return cursor.rowcount > 0
+
+    def get(self, job_id: str) -> dict | None:
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def delete(self, job_id: str) -> bool:
+        with self._connect() as db:
+            db.execute("DELETE FROM items WHERE job_id = ?", (job_id,))
+            return db.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount > 0
+
+    def results(self, job_id: str, offset: int, limit: int) -> list[tuple[int, str]]:
+        """(index, JSON line) of the items from `offset` on, up to the first one not analyzed yet.
+
+        Failed items are stored with their error up front, so stopping at the
+        first pending item keeps a page from skipping past earlier texts.
+        """
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT idx, output FROM items WHERE job_id = ? AND idx >= ? ORDER BY idx LIMIT ?",
+                (job_id, offset, limit),
+            ).fetchall()
+        results = []
+        for row in rows:
+            if row["output"] is None:
+                break
+            results.append((row["idx"], row["output"]))
+        return results
+
+    def claim(self, owner: str, lease_seconds: float) -> dict | None:
+        """Take the oldest queued job, or a running one whose lease lapsed, and lease it to `owner`."""
+        now = time.time()
+        with self._connect() as db:
+            # Take the write lock first, so two runners cannot claim the same job
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?, "
+                "started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (owner, now + lease_seconds, now, row["id"]),
+            )
+            return dict(db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Extend a lease. False when the job was cancelled, deleted or claimed by someone else."""
+        with self._connect() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (time.time() + lease_seconds, job_id, owner),
+            )
+            return cursor.rowcount > 0
+
+    def release(self, job_id: str, owner: str):
+        """Give a running job back to the queue, e.g. on shutdown."""
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'queued', lease_owner = NULL, lease_expires = NULL "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (job_id, owner),
+            )
+
+    def pending(self, job_id: str, limit: int) -> list[tuple[int, str]]:
+        """(index, text) of the next items still to analyze."""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT idx, text FROM items WHERE job_id = ? AND output IS NULL ORDER BY idx LIMIT ?",
+                (job_id, limit),
+            ).fetchall()
+        return [(row["idx"], row["text"]) for row in rows]
+
+    def save(self, job_id: str, owner: str, outputs: list[tuple[int, str, bool]]) -> tuple[int, int] | None:
+        """Store (index, JSON line, failed) outputs of items still pending and advance the job's progress.
+
+        Returns the (stored, failed) counts, or None without storing anything
+        when `owner` no longer holds the job's lease.
+        """
+        stored = failed = 0
+        with self._connect() as db:
+            # The write lock keeps the lease from changing hands between the check and the writes
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT 1 FROM jobs WHERE id = ? AND lease_owner = ? AND status = 'running'", (job_id, owner)
+            ).fetchone()
+            if row is None:
+                return None
+            for idx, output, is_failed in outputs:
+                cursor = db.execute(
+                    "UPDATE items SET output = ?, failed = ?, text = NULL WHERE job_id = ? AND idx = ? AND output IS NULL",
+                    (output, int(is_failed), job_id, idx),
+                )
+                stored += cursor.rowcount
+                failed += cursor.rowcount if is_failed else 0
+            db.execute(
+                "UPDATE jobs SET processed = processed + ?, errors = errors + ? WHERE id = ?",
+                (stored, failed, job_id),
+            )
+        return stored, failed
+
+    def counts(self) -> dict[str, int]:
+        """Jobs per status. Empty until the database exists."""
+        if not self._initialized and not Path(self.path).exists():
+            return {}
+        with self._connect() as db:
+            rows = db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+class LeaseLostError(Exception):
+    """The runner's lease on a job was lost to a cancellation, deletion or another runner."""
+
+class JobRunner:
+    """Background thread analyzing claimed jobs batch by batch through the bulk scheduler lane."""
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        self.owner = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="job-runner", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        from app.services.analyzer import analyzer_service
+
+        jobs = settings.jobs
+        while not self._stop.is_set():
+            if not analyzer_service.ready:
+                self._stop.wait(jobs.POLL_SECONDS)
+                continue
+            try:
+                job = self.store.claim(self.owner, jobs.LEASE_SECONDS)
+            except sqlite3.Error:
+                logger.exception("Could not claim a job")
+                job = None
+            if job is None:
+                self._stop.wait(jobs.POLL_SECONDS)
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                logger.exception("Job %s failed", job["id"])
+                self.store.set_status(job["id"], "failed", str(e))
+
+    def _run(self, job: dict):
+        job_id = job["id"]
+        config = ConfigInput.model_validate_json(job["config"])
+        logger.info("Running job %s (%d/%d texts done)", job_id, job["processed"], job["total"])
+        while True:
+            if self._stop.is_set():
+                self.store.release(job_id, self.owner)
+                return
+            if not self.store.renew(job_id, self.owner, settings.jobs.LEASE_SECONDS):
+                logger.info("Job %s was cancelled or taken over", job_id)
+                return
+            batch = self.store.pending(job_id, settings.jobs.BATCH_SIZE)
+            if not batch:
+                self.store.set_status(job_id, "completed")
+                logger.info("Job %s completed", job_id)
+                return
+            try:
+                results = self._analyze(job_id, [(text, config) for _, text in batch])
+                outputs = [
+                    (idx, dumps({"index": idx, **response_dict(result)}).decode("utf-8"), False)
+                    for (idx, _), result in zip(batch, results)
+                ]
+            except LeaseLostError:
+                logger.info("Job %s was cancelled or taken over", job_id)
+                return
+            except Exception as e:
+                if self._stop.is_set():
+                    self.store.release(job_id, self.owner)
+                    return
+                logger.exception("Batch of job %s failed", job_id)
+                outputs = [(idx, dumps({"index": idx, "error": str(e)}).decode("utf-8"), True) for idx, _ in batch]
+            saved = self.store.save(job_id, self.owner, outputs)
+            if saved is None:
+                logger.info("Job %s was cancelled or taken over", job_id)
+                return
+            stored, failed = saved
+            metrics.JOB_TEXTS.inc(stored - failed, outcome="analyzed")
+            metrics.JOB_TEXTS.inc(failed, outcome="failed")
+
+    def _renew(self, job_id: str):
+        if not self.store.renew(job_id, self.owner, settings.jobs.LEASE_SECONDS):
+            raise LeaseLostError(job_id)
+
+    def _wait(self, job_id: str, future: Future) -> Any:
+        """The future's result, renewing the job's lease while it is pending."""
+        while True:
+            try:
+                return future.result(timeout=settings.jobs.LEASE_SECONDS / 3)
+            except FutureTimeoutError:
+                try:
+                    self._renew(job_id)
+                except LeaseLostError:
+                    future.cancel()
+                    raise
+
+    def _analyze(self, job_id: str, items: list[tuple[str, ConfigInput]]) -> list[Any]:
+        """Run a batch in the bulk lane, waiting while the lane is full or its deadline passes.
+
+        The lease is renewed throughout, since the wait can outlast it.
+        """
+        from app.helpers.analysis import _run_batch_analysis
+        from app.services.scheduler import DeadlineExceededError, QueueFullError, scheduler
+
+        while True:
+            try:
+                return self._wait(job_id, scheduler.submit("bulk", _run_batch_analysis, items))
+            except (QueueFullError, DeadlineExceededError) as e:
+                if self._stop.wait(min(e.retry_after, 5)):
+                    raise
+                self._renew(job_id)
+
+job_store = JobStore(settings.jobs.DB_PATH)
+job_runner = JobRunner(job_store)
+
+def _job_samples():
+    return [((status,), float(count)) for status, count in job_store.counts().items()]
+
+metrics.JOBS.set_function(_job_samples)
@@ -0,0 +1,202 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+LANES = ("interactive", "bulk")
+
+class QueueFullError(Exception):
+    """Raised by `submit` when a lane's queue is at capacity."""
+
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"The {lane} queue is full. Retry in {retry_after}s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+class DeadlineExceededError(Exception):
+    """Set on a job's future when it waited in the queue longer than its lane's deadline."""
+
+    def __init__(self, lane: str, waited: float, retry_after: int):
+        super().__init__(f"Request waited {waited:.1f}s in the {lane} queue and was dropped")
+        self.lane = lane
+        self.retry_after = retry_after
+
+@dataclass
+class _Job:
+    fn: Callable[..., Any]
+    args: tuple
+    future: Future
+    enqueued: float = field(default_factory=time.monotonic)
+
+class InferenceScheduler:
+    """Bounded, priority-aware replacement for a plain thread pool.
+
+    Jobs are queued in one of two lanes. Idle workers always take interactive
+    jobs first, and bulk jobs never occupy the workers reserved for interactive
+    traffic, so a flood of bulk work cannot delay interactive requests by more
+    than one job. Each lane has a maximum queue depth, beyond which `submit`
+    raises QueueFullError immediately, and a deadline after which a job still
+    waiting is failed with DeadlineExceededError instead of being run late.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_queue: dict[str, int],
+        deadlines: dict[str, float | None],
+        reserved_interactive_workers: int = 1,
+    ):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.deadlines = deadlines
+        # At least one worker can always run bulk jobs
+        self.bulk_slots = max(1, self.workers - max(0, reserved_interactive_workers))
+        self._queues: dict[str, deque[_Job]] = {lane: deque() for lane in LANES}
+        self._running = dict.fromkeys(LANES, 0)
+        # Moving average of job durations per lane, for Retry-After estimates
+        self._avg_seconds = dict.fromkeys(LANES, 0.1)
+        self._counts = {lane: {"completed": 0, "rejected": 0, "expired": 0} for lane in LANES}
+        self._cond = threading.Condition()
+        self._threads: list[threading.Thread] = []
+        self._shutdown = False
+
+    def submit(self, lane: str, fn: Callable[..., Any], *args: Any) -> Future:
+        """Queue `fn(*args)` in `lane` and return a future for its result."""
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Scheduler is shut down")
+            queue = self._queues[lane]
+            if len(queue) >= self.max_queue[lane]:
+                self._counts[lane]["rejected"] += 1
+                raise QueueFullError(lane, self._retry_after(lane))
+            job = _Job(fn, args, Future())
+            queue.append(job)
+            # Started on first use so that forked workers never inherit dead threads
+            if not self._threads:
+                self._start()
+            self._cond.notify()
+        return job.future
+
+    def _start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"inference-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _retry_after(self, lane: str) -> int:
+        """Seconds until the lane's current backlog is likely drained. Called with the lock held."""
+        slots = self.workers if lane == "interactive" else self.bulk_slots
+        backlog = len(self._queues[lane]) + self._running[lane]
+        return min(60, max(1, math.ceil(backlog * self._avg_seconds[lane] / slots)))
+
+    def _next(self) -> tuple[str, _Job] | None:
+        """Wait for the next runnable job. Called with the lock held."""
+        while not self._shutdown:
+            if self._queues["interactive"]:
+                return "interactive", self._queues["interactive"].popleft()
+            if self._queues["bulk"] and self._running["bulk"] < self.bulk_slots:
+                return "bulk", self._queues["bulk"].popleft()
+            self._cond.wait()
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                item = self._next()
+                if item is None:
+                    return
+                lane, job = item
+                waited = time.monotonic() - job.enqueued
+                deadline = self.deadlines.get(lane)
+                expired = deadline is not None and waited > deadline
+                if expired:
+                    self._counts[lane]["expired"] += 1
+                    retry_after = self._retry_after(lane)
+                else:
+                    self._running[lane] += 1
+
+            metrics.QUEUE_WAIT_SECONDS.observe(waited, lane=lane)
+            # Skip jobs whose caller already gave up
+            if not job.future.set_running_or_notify_cancel():
+                if not expired:
+                    self._finish(lane, None)
+                continue
+            if expired:
+                logger.warning("Dropped a %s job after %.1fs in the queue", lane, waited)
+                job.future.set_exception(DeadlineExceededError(lane, waited, retry_after))
+                continue
+
+            start = time.monotonic()
+            error = None
+            try:
+                result = job.fn(*job.args)
+            except BaseException as e:
+                error = e
+            # Account for the job before waking its caller, so stats never lag behind responses
+            self._finish(lane, time.monotonic() - start)
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+    def _finish(self, lane: str, duration: float | None):
+        with self._cond:
+            self._running[lane] -= 1
+            if duration is not None:
+                self._counts[lane]["completed"] += 1
+                self._avg_seconds[lane] = 0.8 * self._avg_seconds[lane] + 0.2 * duration
+            # A freed bulk slot may unblock a waiting worker
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                lane: {
+                    "queued": len(self._queues[lane]),
+                    "running": self._running[lane],
+                    "max_queue": self.max_queue[lane],
+                    "avg_job_ms": round(self._avg_seconds[lane] * 1000, 1),
+                    **self._counts[lane],
+                }
+                for lane in LANES
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers after the running jobs, failing everything still queued."""
+        with self._cond:
+            self._shutdown = True
+            pending = [job for queue in self._queues.values() for job in queue]
+            for queue in self._queues.values():
+                queue.clear()
+            self._cond.notify_all()
+        for job in pending:
+            if job.future.set_running_or_notify_cancel():
+                job.future.set_exception(RuntimeError("Scheduler is shutting down"))
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+scheduler = InferenceScheduler(
+    workers=settings.EXECUTOR_MAX_WORKERS,
+    max_queue={lane: settings.scheduler.max_queue(lane) for lane in LANES},
+    deadlines={lane: settings.scheduler.deadline(lane) for lane in LANES},
+    reserved_interactive_workers=settings.scheduler.RESERVED_INTERACTIVE_WORKERS,
+)
+
+def _lane_samples(field: str):
+    return lambda: [((lane,), stats[field]) for lane, stats in scheduler.stats().items()]
+
+metrics.QUEUE_DEPTH.set_function(_lane_samples("queued"))
+metrics.ACTIVE_THREADS.set_function(_lane_samples("running"))
+metrics.REJECTED.set_function(_lane_samples("rejected"))
+metrics.EXPIRED.set_function(_lane_samples("expired"))
+metrics.SCHEDULER_THREADS.set_function(lambda: [((), scheduler.workers)])
@@ -0,0 +1,91 @@
+import re
+from dataclasses import dataclass, field
+from typing import Any
+
+from app.services.backends import ClassificationOutput
+
+_WORD = re.compile(r"\S+")
+
+@dataclass
+class Window:
+    """A slice of a text, in characters.
+
+    `[start, end)` is what the model sees. `[own_start, own_end)` is the part
+    whose tokens and entities this window reports: overlaps are split halfway
+    between consecutive windows, so every position is owned by exactly one.
+    """
+
+    start: int
+    end: int
+    own_start: int
+    own_end: int
+
+@dataclass
+class TokenPrediction:
+    """Merged NER/POS prediction with the same attributes as pysentimiento's output."""
+
+    sentence: str
+    tokens: list[str]
+    labels: list[str]
+    entities: list[dict] = field(default_factory=list)
+
+def word_windows(text: str, size: int, stride: int) -> list[Window]:
+    """Split a text into windows of `size` words, consecutive windows sharing `stride` words."""
+    words = [match.span() for match in _WORD.finditer(text)]
+    if len(words) <= size:
+        return [Window(0, len(text), 0, len(text))]
+    step = max(1, size - stride)
+    starts = list(range(0, len(words) - size, step)) + [len(words) - size]
+    windows = []
+    for k, first in enumerate(starts):
+        last = first + size - 1
+        # Hand over to the next window halfway through the words they share
+        own_first = 0 if k == 0 else (first + starts[k - 1] + size) // 2
+        own_next = None if k == len(starts) - 1 else (starts[k + 1] + last + 1) // 2
+        windows.append(Window(
+            start=words[first][0],
+            end=words[last][1],
+            own_start=0 if k == 0 else words[own_first][0],
+            own_end=len(text) if own_next is None else words[own_next][0],
+        ))
+    return windows
+
+def merge_tokens(text: str, windows: list[Window], preds: list[Any]) -> TokenPrediction:
+    """Merge the NER/POS predictions of a text's windows into one, with offsets into the whole text.
+
+    Tokens are located in their window by searching forward from the previous
+    token; a token that cannot be found (e.g. changed by preprocessing) is placed
+    right after it.
+    """
+    tokens: list[str] = []
+    labels: list[str] = []
+    entities: list[dict] = []
+    for window, pred in zip(windows, preds):
+        chunk = text[window.start:window.end]
+        cursor = 0
+        for token, label in zip(pred.tokens, pred.labels):
+            found = chunk.find(token, cursor)
+            position = found if found >= 0 else cursor
+            cursor = position + len(token) if found >= 0 else cursor
+            if window.own_start <= window.start + position < window.own_end:
+                tokens.append(token)
+                labels.append(label)
+        for entity in getattr(pred, "entities", None) or []:
+            start = window.start + entity["start"]
+            if window.own_start <= start < window.own_end:
+                entities.append({**entity, "start": start, "end": window.start + entity["end"]})
+    return TokenPrediction(sentence=text, tokens=tokens, labels=labels, entities=entities)
+
+def merge_classifications(text: str, windows: list[Window], preds: list[Any]) -> ClassificationOutput:
+    """Average the probabilities of a text's window predictions, weighted by window length."""
+    weights = [window.end - window.start or 1 for window in windows]
+    total = sum(weights)
+    probas: dict[str, float] = {}
+    for weight, pred in zip(weights, preds):
+        for label, p in pred.probas.items():
+            probas[label] = probas.get(label, 0.0) + p * weight / total
+    if isinstance(preds[0].output, list):
+        output: str | list[str] = [label for label, p in probas.items() if p > 0.5]
+    else:
+        output = max(probas, key=probas.get)
+    return ClassificationOutput(sentence=text, output=output, probas=probas)
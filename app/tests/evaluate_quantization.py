@@ -0,0 +1,59 @@
+import sys
+import os
+import json
+import time
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from pysentimiento import create_analyzer
+from app.core.config import settings
+from app.helpers.corpus import read_texts
+from app.services.backends import quantize_dynamic
+
+TASKS = ["sentiment", "emotion", "hate_speech", "irony"]
+
+def timed_predict(analyzer, texts: list[str]) -> tuple[list, float]:
+    """Predict one text at a time, like /analyze does, and return the mean latency in ms."""
+    start = time.perf_counter()
+    preds = [analyzer.predict(text) for text in texts]
+    return preds, (time.perf_counter() - start) * 1000 / len(texts)
+
+def evaluate_quantization(path: str = "requests.jsonl", limit: int = 200) -> dict:
+    lang = settings.pysentimiento.LANG
+    texts = read_texts(path, limit)
+    print(f"Evaluating int8 dynamic quantization on {len(texts)} texts from {path} ({lang})...")
+
+    report = {}
+    for task in TASKS:
+        print(f"\nTask: {task}")
+        float_analyzer = create_analyzer(task=task, lang=lang, batch_size=settings.pysentimiento.BATCH_SIZE)
+        quantized_analyzer = create_analyzer(task=task, lang=lang, batch_size=settings.pysentimiento.BATCH_SIZE)
+        before, after = quantize_dynamic(quantized_analyzer)
+
+        float_preds, float_ms = timed_predict(float_analyzer, texts)
+        quantized_preds, quantized_ms = timed_predict(quantized_analyzer, texts)
+
+        agreement = sum(f.output == q.output for f, q in zip(float_preds, quantized_preds)) / len(texts)
+        max_abs_diff = max(
+            abs(p - q.probas[label])
+            for f, q in zip(float_preds, quantized_preds)
+            for label, p in f.probas.items()
+        )
+        report[task] = {
+            "label_agreement": agreement,
+            "max_abs_proba_diff": max_abs_diff,
+            "float_memory_mb": before / 1024 / 1024,
+            "int8_memory_mb": after / 1024 / 1024,
+            "float_latency_ms": float_ms,
+            "int8_latency_ms": quantized_ms,
+        }
+        print(f"Label agreement: {agreement:.2%} (max abs proba diff {max_abs_diff:.3f})")
+        print(f"Memory: {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB")
+        print(f"Latency: {float_ms:.1f} ms -> {quantized_ms:.1f} ms per text")
+
+    print("\n" + json.dumps(report, indent=2))
+    return report
+
+if __name__ == "__main__":
+    evaluate_quantization(*sys.argv[1:2])
@@ -0,0 +1,56 @@
+import sys
+import os
+import tempfile
+import time
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from app.models.schemas import ConfigInput
+from app.services.jobs import JobStore
+
+def test_job_takeover():
+    store = JobStore(os.path.join(tempfile.mkdtemp(), "jobs.db"))
+    job_id = store.create(ConfigInput(), [("hola", None), ("me encanta", None)])
+    outputs = [(0, '{"index":0}', False), (1, '{"index":1}', False)]
+    failed = False
+
+    print("Claiming the job for runner A with a lease that lapses...")
+    store.claim("A", lease_seconds=0.05)
+    time.sleep(0.1)
+    job = store.claim("B", lease_seconds=60)
+    if job is None or job["lease_owner"] != "B":
+        print(f"ERROR: runner B could not take the job over: {job}")
+        return False
+    print("SUCCESS: runner B took the job over")
+
+    print("\nSaving the same batch from both runners...")
+    saved_a = store.save(job_id, "A", outputs)
+    saved_b = store.save(job_id, "B", outputs)
+    saved_again = store.save(job_id, "B", outputs)
+    if saved_a is not None:
+        print(f"ERROR: runner A stored {saved_a} without holding the lease")
+        failed = True
+    elif saved_b != (2, 0) or saved_again != (0, 0):
+        print(f"ERROR: runner B stored {saved_b} then {saved_again}, expected (2, 0) then (0, 0)")
+        failed = True
+    else:
+        print("SUCCESS: only the lease owner stored the batch, and only once")
+
+    job = store.get(job_id)
+    if (job["total"], job["processed"]) != (2, 2):
+        print(f"ERROR: total={job['total']} processed={job['processed']}")
+        failed = True
+    else:
+        print("SUCCESS: total=2 processed=2")
+
+    print("\nRenewing the lapsed lease of runner A...")
+    if store.renew(job_id, "A", 60):
+        print("ERROR: runner A renewed a lease it lost")
+        failed = True
+    else:
+        print("SUCCESS: runner A is told it lost the job")
+    return not failed
+
+if __name__ == "__main__":
+    sys.exit(0 if test_job_takeover() else 1)
@@ -0,0 +1,57 @@
+import sys
+import os
+import tempfile
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from app.models.schemas import ConfigInput
+from app.services.jobs import JobStore
+
+def page_all(store: JobStore, job_id: str, limit: int) -> list[int]:
+    """Indices returned by paging from 0 with next_offset until a page comes back empty."""
+    seen = []
+    offset = 0
+    while True:
+        rows = store.results(job_id, offset, limit)
+        if not rows:
+            return seen
+        seen.extend(idx for idx, _ in rows)
+        offset = rows[-1][0] + 1
+
+def test_job_paging():
+    store = JobStore(os.path.join(tempfile.mkdtemp(), "jobs.db"))
+    items = [("hola", None), (None, "text is empty"), ("me encanta", None), (None, "text is empty")]
+    job_id = store.create(ConfigInput(), items)
+    failed = False
+
+    print("Paging a queued job mixing invalid and valid texts...")
+    seen = page_all(store, job_id, limit=10)
+    if seen:
+        print(f"ERROR: got {seen} before index 0 was analyzed")
+        failed = True
+    else:
+        print("SUCCESS: nothing returned ahead of the pending index 0")
+
+    print("\nAnalyzing index 0 only...")
+    store.claim("runner", lease_seconds=60)
+    store.save(job_id, "runner", [(0, '{"index":0}', False)])
+    seen = page_all(store, job_id, limit=10)
+    if seen != [0, 1]:
+        print(f"ERROR: got {seen}, expected [0, 1]")
+        failed = True
+    else:
+        print(f"SUCCESS: got {seen}, stopping at the pending index 2")
+
+    print("\nAnalyzing the rest and paging two at a time...")
+    store.save(job_id, "runner", [(2, '{"index":2}', False)])
+    seen = page_all(store, job_id, limit=2)
+    if seen != [0, 1, 2, 3]:
+        print(f"ERROR: got {seen}, expected [0, 1, 2, 3]")
+        failed = True
+    else:
+        print(f"SUCCESS: got {seen}")
+    return not failed
+
+if __name__ == "__main__":
+    sys.exit(0 if test_job_paging() else 1)
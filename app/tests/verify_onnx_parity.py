@@ -0,0 +1,45 @@
+import sys
+import os
+import time
+from pathlib import Path
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from pysentimiento import create_analyzer
+from app.core.config import settings
+from app.helpers.corpus import read_texts
+from app.services.backends import OnnxSequenceClassifier, check_parity, export_onnx
+
+TASKS = ["sentiment", "emotion", "hate_speech", "irony"]
+
+def test_onnx_parity(path: str = "requests.jsonl", limit: int = 200):
+    lang = settings.pysentimiento.LANG
+    texts = read_texts(path, limit)
+    print(f"Comparing torch and ONNX backends on {len(texts)} texts ({lang})...")
+
+    for task in TASKS:
+        print(f"\nTask: {task}")
+        torch_analyzer = create_analyzer(task=task, lang=lang, batch_size=settings.pysentimiento.BATCH_SIZE)
+        onnx_path = Path(settings.inference.ONNX_DIR) / f"{task}-{lang}"
+        if not (onnx_path / "analyzer.json").exists():
+            print(f"Exporting to {onnx_path}...")
+            export_onnx(torch_analyzer, onnx_path)
+        onnx_analyzer = OnnxSequenceClassifier(onnx_path)
+
+        parity = check_parity(torch_analyzer, onnx_analyzer, texts)
+        print(f"Max abs probability diff: {parity['max_abs_diff']:.2e}")
+        print(f"Label agreement: {parity['label_agreement']:.2%}")
+        if parity["max_abs_diff"] > settings.inference.ONNX_PARITY_TOLERANCE:
+            print(f"ERROR: above tolerance {settings.inference.ONNX_PARITY_TOLERANCE}")
+        else:
+            print("SUCCESS: within tolerance.")
+
+        for name, analyzer in [("torch", torch_analyzer), ("onnx", onnx_analyzer)]:
+            start = time.perf_counter()
+            analyzer.predict(texts)
+            elapsed = time.perf_counter() - start
+            print(f"{name}: {elapsed:.2f}s ({len(texts) / elapsed:.1f} texts/s)")
+
+if __name__ == "__main__":
+    test_onnx_parity(*sys.argv[1:2])
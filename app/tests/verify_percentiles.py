@@ -0,0 +1,27 @@
+import sys
+import os
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from benchmarks.load_test import percentile
+
+def test_percentiles():
+    # Nearest rank of 1..100 is the value itself
+    samples = [float(i) for i in range(1, 101)]
+    expected = {50: 50.0, 95: 95.0, 99: 99.0, 100: 100.0, 0: 1.0}
+    failed = False
+    for q, value in expected.items():
+        actual = percentile(samples, q)
+        if actual != value:
+            print(f"ERROR: p{q} of 1..100 is {actual}, expected {value}")
+            failed = True
+        else:
+            print(f"SUCCESS: p{q} = {actual}")
+    if percentile([7.0], 99) != 7.0:
+        print("ERROR: p99 of a single sample is not that sample")
+        failed = True
+    return not failed
+
+if __name__ == "__main__":
+    sys.exit(0 if test_percentiles() else 1)
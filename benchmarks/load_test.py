@@ -0,0 +1,274 @@
+"""
+Load benchmark: throughput, latency percentiles and peak memory of the API.
+
+Drives the app in-process through httpx's ASGI transport, or a running server
+with --url. Texts are replayed from a JSONL or CSV file (--input) or generated
+with controlled lengths (--lengths), and each request enables a task set drawn
+from a weighted --mix. Runs are reproducible for a given --seed. Save a run
+with --output and pass it as --compare to a later run to fail (exit code 1) on
+regressions. Needs `pip install httpx`.
+
+Usage:
+    python benchmarks/load_test.py --requests 500 --concurrency 8 --output before.json
+    python benchmarks/load_test.py --input requests.jsonl --mix sentiment=3 sentiment+emotion+ner=1
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --endpoint batch --batch-size 32
+    python benchmarks/load_test.py --requests 500 --concurrency 8 --compare before.json --tolerance 0.1
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.helpers.corpus import read_texts
+
+ENDPOINTS = {"analyze": "/analyze", "batch": "/analyze/batch"}
+
+# Metrics where a higher value is a regression; the others regress when they drop
+HIGHER_IS_WORSE = ("latency_ms", "peak_rss_mb", "peak_pss_mb", "error_rate")
+
+WORDS = (
+    "el servicio fue excelente y la atención muy amable pero el envío llegó tarde "
+    "no me gustó nada la calidad del producto aunque el precio es bueno "
+    "quiero hablar con alguien del banco sobre mi tarjeta de crédito hoy mismo"
+).split()
+
+def synthetic_texts(count: int, lengths: list[int], rng: random.Random) -> list[str]:
+    """`count` texts of random words, cycling through the target lengths in characters."""
+    texts = []
+    for i in range(count):
+        target = lengths[i % len(lengths)]
+        words: list[str] = []
+        while sum(len(w) + 1 for w in words) < target:
+            words.append(rng.choice(WORDS))
+        texts.append(" ".join(words)[:target])
+    return texts
+
+def parse_mix(values: list[str]) -> list[tuple[list[str], float]]:
+    """Parse `task+task=weight` items into weighted task sets."""
+    mix = []
+    for value in values:
+        tasks, _, weight = value.partition("=")
+        mix.append((tasks.split("+"), float(weight or 1)))
+    return mix
+
+def percentile(samples: list[float], q: float) -> float:
+    """Nearest-rank percentile of sorted samples."""
+    index = max(0, min(len(samples) - 1, math.ceil(q / 100 * len(samples)) - 1))
+    return samples[index]
+
+def build_requests(args: argparse.Namespace) -> list[dict]:
+    """The request bodies of a run, in order, drawn from a seeded generator."""
+    rng = random.Random(args.seed)
+    per_request = args.batch_size if args.endpoint == "batch" else 1
+    if args.input:
+        texts = read_texts(args.input, text_field=args.text_field)
+        if not texts:
+            raise SystemExit(f"No texts in {args.input}")
+    else:
+        texts = synthetic_texts(args.requests * per_request, args.lengths, rng)
+    mix = parse_mix(args.mix)
+    task_sets = [tasks for tasks, _ in mix]
+    weights = [weight for _, weight in mix]
+
+    def item(index: int) -> dict:
+        tasks = rng.choices(task_sets, weights)[0]
+        config = {"lang": args.lang, **{task: True for task in tasks}}
+        return {"text": texts[index % len(texts)], "config": config}
+
+    bodies = []
+    for i in range(args.requests):
+        if args.endpoint == "batch":
+            bodies.append({"items": [item(i * per_request + j) for j in range(per_request)]})
+        else:
+            bodies.append(item(i))
+    return bodies
+
+@asynccontextmanager
+async def client(url: str | None, timeout: float) -> AsyncIterator:
+    """An HTTP client for `url`, or for the app in this process with its lifespan running."""
+    import httpx
+
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=timeout) as http:
+            yield http
+        return
+    from main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=timeout) as http:
+            yield http
+
+async def memory(http, in_process: bool) -> dict:
+    """Current memory of the server: its RSS and, when preforked, the PSS of all its workers."""
+    if in_process:
+        from app.helpers.memory import process_memory
+
+        info = process_memory()
+        return {"rss_mb": info.get("rss_mb", info.get("max_rss_mb", 0))}
+    try:
+        body = (await http.get("/health")).json()
+    except Exception:
+        return {}
+    workers = body.get("workers") or []
+    sample = {"rss_mb": max([w.get("rss_mb", 0) for w in workers] or [body.get("process", {}).get("rss_mb", 0)])}
+    if workers:
+        sample["pss_mb"] = sum(w.get("pss_mb", 0) for w in workers)
+    return sample
+
+async def wait_ready(http, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await http.get("/health")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"Not ready after {timeout}s")
+
+async def run(args: argparse.Namespace) -> dict:
+    bodies = build_requests(args)
+    path = ENDPOINTS[args.endpoint]
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+    peak: dict[str, float] = {}
+
+    async with client(args.url, args.timeout) as http:
+        await wait_ready(http, args.timeout)
+        for body in bodies[:args.warmup]:
+            await http.post(path, json=body)
+
+        async def sample_memory(stop: asyncio.Event):
+            while not stop.is_set():
+                for name, value in (await memory(http, args.url is None)).items():
+                    peak[name] = max(peak.get(name, 0), value)
+                try:
+                    await asyncio.wait_for(stop.wait(), args.memory_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for body in bodies:
+            queue.put_nowait(body)
+
+        async def user():
+            while not queue.empty():
+                body = queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    code = str((await http.post(path, json=body)).status_code)
+                except Exception as e:
+                    code = type(e).__name__
+                latencies.append((time.perf_counter() - start) * 1000)
+                statuses[code] = statuses.get(code, 0) + 1
+
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_memory(stop))
+        start = time.perf_counter()
+        await asyncio.gather(*[user() for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await sampler
+        for name, value in (await memory(http, args.url is None)).items():
+            peak[name] = max(peak.get(name, 0), value)
+
+    latencies.sort()
+    texts = len(bodies) * (args.batch_size if args.endpoint == "batch" else 1)
+    errors = sum(count for code, count in statuses.items() if code != "200")
+    metrics = {
+        "throughput_rps": round(len(bodies) / elapsed, 2),
+        "throughput_texts_per_s": round(texts / elapsed, 2),
+        "latency_ms_p50": round(percentile(latencies, 50), 2),
+        "latency_ms_p95": round(percentile(latencies, 95), 2),
+        "latency_ms_p99": round(percentile(latencies, 99), 2),
+        "latency_ms_max": round(latencies[-1], 2),
+        "latency_ms_mean": round(statistics.fmean(latencies), 2),
+        "error_rate": round(errors / len(bodies), 4),
+    }
+    metrics.update({f"peak_{name}": round(value, 1) for name, value in peak.items()})
+    return {
+        "python": sys.version.split()[0],
+        "target": args.url or "in-process",
+        "parameters": {
+            "endpoint": args.endpoint,
+            "requests": len(bodies),
+            "concurrency": args.concurrency,
+            "batch_size": args.batch_size if args.endpoint == "batch" else 1,
+            "input": args.input or f"synthetic {args.lengths}",
+            "mix": args.mix,
+            "lang": args.lang,
+            "seed": args.seed,
+        },
+        "duration_s": round(elapsed, 3),
+        "statuses": statuses,
+        "metrics": metrics,
+    }
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Metrics that got worse than the baseline by more than `tolerance` (a fraction)."""
+    regressions = []
+    for metric, value in results["metrics"].items():
+        before = baseline.get("metrics", {}).get(metric)
+        if before is None:
+            continue
+        if metric.startswith(HIGHER_IS_WORSE):
+            # Any errors count when the baseline had none
+            regressed = value > before * (1 + tolerance)
+        else:
+            regressed = value < before * (1 - tolerance)
+        if regressed:
+            change = f" ({value / before - 1:+.0%})" if before else ""
+            regressions.append(f"{metric}: {before} -> {value}{change}")
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="Benchmark a running server instead of the app in this process")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="analyze", help="Endpoint to drive")
+    parser.add_argument("--requests", type=int, default=200, help="Requests to send, warm-up excluded")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at once")
+    parser.add_argument("--batch-size", type=int, default=16, help="Texts per request with --endpoint batch")
+    parser.add_argument("--warmup", type=int, default=5, help="Requests sent one at a time before measuring")
+    parser.add_argument("--input", help="JSONL or CSV file to replay texts from, cycling when shorter than the run")
+    parser.add_argument("--text-field", help="Field holding the text in --input records")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[80, 280, 1000], help="Synthetic text lengths in characters")
+    parser.add_argument("--mix", nargs="+", default=["sentiment"], help="Weighted task sets, e.g. sentiment=3 sentiment+emotion=1")
+    parser.add_argument("--lang", default="es", help="Language of every request")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of text generation and task mix")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for readiness and for each request")
+    parser.add_argument("--memory-interval", type=float, default=0.5, help="Seconds between memory samples")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed change against --compare, as a fraction")
+    args = parser.parse_args()
+
+    # One INFO line per request would slow the run down and bury the results
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
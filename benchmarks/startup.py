@@ -0,0 +1,115 @@
+"""
+Startup benchmark: import times and time until /health reports ready.
+
+Every measurement runs in a fresh interpreter, repeated --runs times, and the
+median is reported. Save a run with --output and pass it as --baseline to a
+later run to fail (exit code 1) on regressions.
+
+Usage:
+    python benchmarks/startup.py --runs 5 --output startup.json
+    python benchmarks/startup.py --runs 5 --baseline startup.json --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules whose import cost is tracked, from the lightest to the whole app
+MODULES = ("app.core.config", "app.services.analyzer", "main")
+
+def import_seconds(module: str) -> float:
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def ready_run(timeout: float) -> dict:
+    """Start the API and poll /health until it answers 200. Returns the time to ready and its breakdown."""
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env={**os.environ, "ENVIRONMENT": "production"},
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    body = json.load(response)
+                return {"ready": time.perf_counter() - start, "breakdown": body.get("startup", {})}
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                # 503 while loading, or not listening yet
+                time.sleep(0.05)
+        raise TimeoutError(f"Not ready after {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+def run(runs: int, timeout: float, skip_ready: bool) -> dict:
+    results: dict = {"python": sys.version.split()[0], "runs": runs, "metrics": {}}
+    for module in MODULES:
+        samples = [import_seconds(module) for _ in range(runs)]
+        results["metrics"][f"import {module}"] = round(statistics.median(samples), 4)
+        print(f"import {module}: {statistics.median(samples):.3f}s (min {min(samples):.3f}s)", file=sys.stderr)
+
+    if not skip_ready:
+        samples = [ready_run(timeout) for _ in range(runs)]
+        median = statistics.median(sample["ready"] for sample in samples)
+        results["metrics"]["time to ready"] = round(median, 4)
+        # Server-side breakdown of the median run
+        results["breakdown"] = min(samples, key=lambda sample: abs(sample["ready"] - median))["breakdown"]
+        print(f"time to ready: {median:.3f}s", file=sys.stderr)
+        for phase, seconds in results["breakdown"].items():
+            print(f"  {phase}: {seconds:.3f}s", file=sys.stderr)
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Metrics that got slower than the baseline by more than `tolerance` (a fraction)."""
+    regressions = []
+    for metric, seconds in results["metrics"].items():
+        before = baseline.get("metrics", {}).get(metric)
+        if before and seconds > before * (1 + tolerance):
+            regressions.append(f"{metric}: {before:.3f}s -> {seconds:.3f}s (+{(seconds / before - 1):.0%})")
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions per measurement")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for the server to be ready")
+    parser.add_argument("--skip-ready", action="store_true", help="Only measure import times")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline, as a fraction")
+    args = parser.parse_args()
+
+    results = run(args.runs, args.timeout, args.skip_ready)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,35 @@
+# Imported first, so that the startup timer's import phase covers everything below
+from app.core.timing import startup_timer
+
+import asyncio
 import logging
 import os
+import time
 from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import FastAPI, status
 from fastapi.responses import RedirectResponse
-from app.core.config import executor, settings
+from app.core.config import settings
+from app.core.server import configure_torch_threads, serve_preforked
+from app.helpers.analysis import task_executor
 from app.services.analyzer import analyzer_service
+from app.services.jobs import job_runner
+from app.services.scheduler import scheduler
 from app.routes.api import router
+from app.routes.jobs import router as jobs_router
+
+startup_timer.record("import", time.perf_counter() - startup_timer.origin)
 
 logger = logging.getLogger(__name__)
 
+def _on_models_loaded(future: asyncio.Future):
+    if future.exception() is None:
+        logger.info("Models loaded successfully!")
+        startup_timer.mark_ready()
+    else:
+        logger.error("Model loading failed: %s", future.exception())
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager to handle startup and shutdown events."""
@@ -18,13 +37,21 @@ async def lifespan(app: FastAPI):
         level=settings.LOG_LEVEL,
         format=settings.LOG_FORMAT,
     )
+    configure_torch_threads()
+    # Load in the background so the server starts accepting connections and
+    # /health can report readiness. Early requests wait on the in-flight loads.
     logger.info("Loading models...")
-    analyzer_service.load_models()
-    logger.info("Models loaded successfully!")
+    loading = asyncio.get_running_loop().run_in_executor(None, analyzer_service.load_models)
+    loading.add_done_callback(_on_models_loaded)
+    if settings.jobs.ENABLED:
+        job_runner.start()
     yield
     logger.info("Shutting down...")
+    # Hand the current job back to the queue before the scheduler stops
+    job_runner.stop(timeout=settings.jobs.LEASE_SECONDS)
     analyzer_service.unload_models()
-    executor.shutdown(wait=True)
+    scheduler.shutdown(wait=True)
+    task_executor.shutdown(wait=True)
 
 app = FastAPI(
     title="Sentiment Analysis API",
@@ -43,7 +70,7 @@ This API provides comprehensive text analysis capabilities including:
 
 ### Features
 
-- 🚀 Fast and scalable inference using thread pool executors
+- 🚀 Fast and scalable inference on a bounded, priority-aware thread pool
 - 🧠 Multiple pre-trained NLP models
 - 🌍 Multi-language support (Spanish by default, configurable)
 - ⚡ Async API with automatic model loading/unloading
@@ -69,6 +96,8 @@ Check `/health` endpoint to verify service status.
     lifespan=lifespan,
 )
 app.include_router(router)
+if settings.jobs.ENABLED:
+    app.include_router(jobs_router)
 
 @app.get("/", include_in_schema=False)
 async def root():
@@ -76,12 +105,16 @@ async def root():
     return RedirectResponse(url="/docs", status_code=status.HTTP_308_PERMANENT_REDIRECT)
 
 if __name__ == "__main__":
-    workers = os.cpu_count() or 1
-    logger.info("Starting uvicorn with %s workers", workers)
-    uvicorn.run(
-        "main:app", 
-        host="0.0.0.0",
-        port=8000,
-        workers=1,
-        reload=settings.ENVIRONMENT == "development"
-    )
+    workers = settings.WORKERS or os.cpu_count() or 1
+    reload = settings.ENVIRONMENT == "development"
+    if workers > 1 and not reload:
+        serve_preforked(app, host="0.0.0.0", port=8000, workers=workers)
+    else:
+        logger.info("Starting uvicorn with 1 worker")
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8000,
+            workers=1,
+            reload=reload,
+        )